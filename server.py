@@ -15,27 +15,64 @@ CAMBIOS v1.9.0:
 
 import eventlet
 eventlet.monkey_patch()
+from eventlet import tpool  # import eventlet no expone el submódulo
 
 import os
+import re
+import csv
+import json
 import time
+import queue
+import socket
+import select
+import struct
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import types
+import uuid
+import atexit
+import string
+import hashlib
 import requests
 from datetime import datetime, timezone, timedelta
 from collections import deque
-from io import BytesIO
+from io import BytesIO, StringIO
 import numpy as np
 
 try:
     import psycopg2
     from psycopg2 import pool
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import RealDictCursor, execute_values
     POSTGRES_AVAILABLE = True
+    try:
+        # psycopg2 es una extensión C: sin este parche sus esperas de socket
+        # bloquean el hub entero y toda la E/S de BD queda serializada
+        from psycogreen.eventlet import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
 except ImportError:
     POSTGRES_AVAILABLE = False
-    psycopg2, pool, RealDictCursor = None, None, None
+    psycopg2, pool, RealDictCursor, execute_values = None, None, None, None
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
 
-from flask import Flask, render_template, jsonify, request, send_file
+try:
+    from flask_compress import Compress
+    COMPRESS_AVAILABLE = True
+except ImportError:
+    Compress = None
+    COMPRESS_AVAILABLE = False
+
+from flask import Flask, render_template, jsonify, request, send_file, Response, stream_with_context
 from flask_socketio import SocketIO
-from weasyprint import HTML
+from weasyprint import HTML, CSS
+from weasyprint.text.fonts import FontConfiguration
 from dotenv import load_dotenv
 from openai import OpenAI
 
@@ -43,8 +80,18 @@ from flask import session, redirect, url_for  # Añadir a imports existentes
 from datetime import timedelta  # Añadir si no existe
 from auth import init_auth_routes, login_required, get_current_user
 
+# Logging con cola: el formateo y la escritura a stdout quedan fuera del
+# greenlet de la petición (print sin búfer compite con el trabajo real)
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+logging.basicConfig(level=logging.INFO, format="%(message)s", handlers=[QueueHandler(_log_queue)])
+log = logging.getLogger("humans")
+
 load_dotenv(".env")
-client = OpenAI()
+# Cliente único a nivel de módulo: el httpx interno mantiene la conexión
+# TCP+TLS viva entre informes, sin handshake por llamada
+client = OpenAI(timeout=60.0, max_retries=1)
 LLM_MODEL = "gpt-4o-mini"
 
 SYSTEM_NAME = "HumanS – Monitorización Vital Continua"
@@ -56,6 +103,30 @@ MAILJET_SENDER_EMAIL = os.environ.get("MAILJET_SENDER_EMAIL", "")
 
 email_config = {"email_to": "", "patient_name": "", "patient_room": "", "patient_residence": ""}
 
+# Serializa las mutaciones de email_config entre greenlets (POST de config,
+# listener de NOTIFY y carga inicial pueden solaparse); las lecturas van sin
+# lock porque el dict se reemplaza entero, nunca se muta in situ
+_email_cfg_lock = eventlet.semaphore.Semaphore(1)
+_email_config_epoch = 0  # Nº de cambios aplicados, visible en diagnósticos
+
+def _set_email_config(cfg):
+    global email_config, _email_config_epoch
+    with _email_cfg_lock:
+        email_config = cfg
+        _email_config_epoch += 1
+        _rebuild_patient_info()
+
+# Snapshot inmutable del paciente, reconstruido solo al guardar la configuración
+_patient_info = types.SimpleNamespace(name="N/A", room="N/A", residence="N/A")
+
+def _rebuild_patient_info():
+    global _patient_info, _email_diag_dirty
+    _email_diag_dirty = True
+    _patient_info = types.SimpleNamespace(
+        name=email_config.get("patient_name") or "N/A",
+        room=email_config.get("patient_room") or "N/A",
+        residence=email_config.get("patient_residence") or "N/A")
+
 CRITICAL_SPO2 = 92
 CRITICAL_HR_LOW = 60
 CRITICAL_HR_HIGH = 150
@@ -64,13 +135,102 @@ DEVICE_OFFLINE_TIMEOUT = 60  # Segundos sin datos para considerar "desconectado"
 DEVICE_CONNECT_COOLDOWN = 300  # Cooldown entre notificaciones de conexión
 
 MAX_HISTORY = 120
-spo2_hist = deque(maxlen=MAX_HISTORY)
-hr_hist = deque(maxlen=MAX_HISTORY)
+
+class _Ring:
+    """Buffer circular int16 preasignado con cursor de escritura.
+
+    Sustituye a deque(maxlen=...): misma semántica de ventana deslizante
+    pero sin ints boxed (2 B/muestra) y con lectura ordenada como array
+    NumPy contiguo, cuyo .tolist() es mucho más rápido que iterar el deque.
+    """
+    __slots__ = ("buf", "idx", "full")
+
+    def __init__(self, size=MAX_HISTORY):
+        self.buf = np.zeros(size, np.int16)
+        self.idx = 0
+        self.full = False
+
+    def append(self, v):
+        self.buf[self.idx] = v
+        self.idx = (self.idx + 1) % self.buf.size
+        if self.idx == 0: self.full = True
+
+    def __len__(self):
+        return self.buf.size if self.full else self.idx
+
+    def __bool__(self):
+        return self.full or self.idx > 0
+
+    def ordered(self):
+        """Contenido en orden de inserción (copia solo cuando hay wrap)."""
+        if self.full:
+            return np.concatenate((self.buf[self.idx:], self.buf[:self.idx]))
+        return self.buf[:self.idx]
+
+    def last(self):
+        return int(self.buf[self.idx - 1])
+
+    def oldest(self):
+        return int(self.buf[self.idx] if self.full else self.buf[0])
+
+spo2_hist = _Ring()
+hr_hist = _Ring()
+# Timestamp formateado una sola vez al ingestar; los lectores solo copian
+ts_hist = deque(maxlen=MAX_HISTORY)
+
+# Copia cacheada de los históricos: se rehace solo cuando entra una muestra,
+# no en cada conexión/emisión (tormentas de reconexión incluidas)
+_hist_snapshot = ([], [])
+_hist_snapshot_dirty = True
+
+class _RunningStats:
+    """Agregados de TODA la sesión, actualizados en el ingest con O(1) memoria
+    (Welford para la varianza). El modo sin BD deja de limitarse a las 120
+    muestras del ring para sus estadísticas."""
+    __slots__ = ("n", "mean", "m2", "mn", "mx", "crit")
+
+    def __init__(self):
+        self.n = 0; self.mean = 0.0; self.m2 = 0.0
+        self.mn = None; self.mx = None; self.crit = 0
+
+    def add(self, v, crit=False):
+        self.n += 1
+        d = v - self.mean
+        self.mean += d / self.n
+        self.m2 += d * (v - self.mean)
+        if self.mn is None or v < self.mn: self.mn = v
+        if self.mx is None or v > self.mx: self.mx = v
+        if crit: self.crit += 1
+
+_spo2_run = _RunningStats()
+_hr_run = _RunningStats()
+
+def get_hist_snapshot():
+    global _hist_snapshot, _hist_snapshot_dirty
+    if _hist_snapshot_dirty:
+        s, h = spo2_hist.ordered(), hr_hist.ordered()
+        # Máscara de críticos vectorizada: los clientes colorean puntos sin
+        # re-evaluar los umbrales muestra a muestra en JS
+        crit = ((s < CRITICAL_SPO2) | (h < CRITICAL_HR_LOW) | (h > CRITICAL_HR_HIGH)).astype(np.uint8)
+        _hist_snapshot = (s.tolist(), h.tolist(), crit.tolist())
+        _hist_snapshot_dirty = False
+    return _hist_snapshot
 
 packet_count = 0
 current_distance = 0.0
 current_rssi = None
-last_packet_time = None
+last_packet_time = None  # Epoch (time.time()); evita datetime en el hot path
+
+# strftime es caro (parseo de formato + locale) y receive_data lo llama por
+# paquete: memoizar la etiqueta HH:MM:SS por segundo entero
+_hms_cache = (None, "")
+
+def _fmt_hms(epoch):
+    global _hms_cache
+    sec = int(epoch)
+    if _hms_cache[0] != sec:
+        _hms_cache = (sec, datetime.fromtimestamp(sec, timezone.utc).strftime("%H:%M:%S"))
+    return _hms_cache[1]
 last_spo2_alert_time = 0
 last_hr_alert_time = 0
 last_spo2_critical = False
@@ -80,7 +240,45 @@ last_device_connect_notification = 0  # Timestamp última notificación de conex
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'humans-2024')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=8)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+
+# Comprimir respuestas JSON/CSV grandes (el histórico de 10k filas es muy repetitivo)
+if COMPRESS_AVAILABLE:
+    app.config.update(COMPRESS_MIMETYPES=['application/json', 'text/csv'],
+                      COMPRESS_LEVEL=6, COMPRESS_MIN_SIZE=1024, COMPRESS_STREAMS=True)
+    Compress(app)
+
+# orjson (Rust, SIMD) como codificador JSON de Flask y Socket.IO si está disponible
+_socketio_kwargs = {}
+if ORJSON_AVAILABLE:
+    from flask.json.provider import DefaultJSONProvider
+
+    class _ORJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, option=orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    class _ORJSONSocketIO:
+        """Shim con la interfaz dumps/loads que espera python-socketio.
+
+        Los 'sample'/'snapshot' salen por las colas por cliente (_relay emite
+        con to=sid), así que cada dashboard paga su propia codificación: con
+        N clientes son N dumps por frame, y la velocidad de orjson se
+        multiplica por ese N.
+        """
+        @staticmethod
+        def dumps(obj, *args, **kwargs):
+            return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+        @staticmethod
+        def loads(s, *args, **kwargs):
+            return orjson.loads(s)
+
+    app.json = _ORJSONProvider(app)
+    _socketio_kwargs["json"] = _ORJSONSocketIO
+
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', **_socketio_kwargs)
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 db_pool = None
@@ -89,21 +287,57 @@ db_pool = None
 # DATABASE FUNCTIONS
 # ============================================================
 
+# Tamaño del pool ajustable a la concurrencia real (greenlets de API +
+# flushers); con maxconn corto los greenlets se serializan esperando getconn
+PG_POOL_MIN = int(os.environ.get("PG_MIN", 2))
+PG_POOL_MAX = int(os.environ.get("PG_MAX", 25))
+_pool_sem = None  # Los que esperan ceden el greenlet en vez de recibir PoolError
+
+def _dsn():
+    dsn = DATABASE_URL.replace("postgres://", "postgresql://", 1) if DATABASE_URL.startswith("postgres://") else DATABASE_URL
+    # application_name identifica cada proceso en pg_stat_activity (y en el
+    # panel de PgBouncer si el DSN apunta a él)
+    if "application_name" not in dsn:
+        dsn += f"{'&' if '?' in dsn else '?'}application_name=humans-{os.getpid()}"
+    return dsn
+
 def init_db_pool():
-    global db_pool
+    global db_pool, _pool_sem
     if not POSTGRES_AVAILABLE or not DATABASE_URL: return False
     try:
-        conn_str = DATABASE_URL.replace("postgres://", "postgresql://", 1) if DATABASE_URL.startswith("postgres://") else DATABASE_URL
-        db_pool = pool.ThreadedConnectionPool(minconn=1, maxconn=10, dsn=conn_str)
-        print("✅ PostgreSQL conectado")
+        db_pool = pool.ThreadedConnectionPool(minconn=PG_POOL_MIN, maxconn=PG_POOL_MAX, dsn=_dsn())
+        _pool_sem = eventlet.semaphore.Semaphore(PG_POOL_MAX)
+        # Las minconn conexiones ya se abren en el constructor; este ciclo las
+        # valida para que un DSN roto aparezca en el log de arranque, no en la
+        # primera petición real
+        warm = [db_pool.getconn() for _ in range(PG_POOL_MIN)]
+        for c in warm: db_pool.putconn(c)
+        log.info(f"✅ PostgreSQL conectado (pool {PG_POOL_MIN}-{PG_POOL_MAX})")
         return True
     except Exception as e:
-        print(f"❌ PostgreSQL: {e}")
+        log.error(f"❌ PostgreSQL: {e}")
         return False
 
-def get_db_connection(): return db_pool.getconn() if db_pool else None
+def get_db_connection():
+    if not db_pool: return None
+    _pool_sem.acquire()
+    try:
+        conn = db_pool.getconn()
+        try:
+            # Descartar conexiones rancias en el checkout (p. ej. cerradas por el servidor)
+            with conn.cursor() as cur: cur.execute("SELECT 1")
+            return conn
+        except Exception:
+            db_pool.putconn(conn, close=True)
+            return db_pool.getconn()
+    except Exception:
+        _pool_sem.release()
+        return None
+
 def release_db_connection(conn):
-    if db_pool and conn: db_pool.putconn(conn)
+    if db_pool and conn:
+        db_pool.putconn(conn)
+        _pool_sem.release()
 
 def init_database():
     conn = get_db_connection()
@@ -111,30 +345,93 @@ def init_database():
     try:
         with conn.cursor() as cur:
             cur.execute("""
-                CREATE TABLE IF NOT EXISTS vital_signs (id SERIAL PRIMARY KEY, timestamp TIMESTAMPTZ DEFAULT NOW(),
-                    spo2 INTEGER, hr INTEGER, spo2_critical BOOLEAN, hr_critical BOOLEAN, distance FLOAT, rssi INTEGER, patient_id VARCHAR(100));
+                -- Particionada por día: los despliegues existentes conservan su
+                -- tabla plana (IF NOT EXISTS); las instalaciones nuevas ganan
+                -- índices acotados por partición y retención vía DROP PARTITION
+                -- SMALLINT: SpO2 (35-100) y HR (25-250) caben en 2 bytes; la
+                -- fila y los índices INCLUDE encogen, y el escaneo de 24 h lee
+                -- menos páginas de heap
+                CREATE TABLE IF NOT EXISTS vital_signs (id SERIAL, timestamp TIMESTAMPTZ DEFAULT NOW(),
+                    spo2 SMALLINT, hr SMALLINT, spo2_critical BOOLEAN, hr_critical BOOLEAN, distance FLOAT, rssi SMALLINT, patient_id VARCHAR(100),
+                    PRIMARY KEY (id, timestamp)) PARTITION BY RANGE (timestamp);
                 CREATE TABLE IF NOT EXISTS alerts (id SERIAL PRIMARY KEY, timestamp TIMESTAMPTZ DEFAULT NOW(),
                     alert_type VARCHAR(50), spo2 INTEGER, hr INTEGER, message TEXT, email_sent BOOLEAN, email_to VARCHAR(255), patient_id VARCHAR(100));
                 CREATE TABLE IF NOT EXISTS email_config (id SERIAL PRIMARY KEY, email_to VARCHAR(255), patient_name VARCHAR(255),
                     patient_room VARCHAR(100), patient_residence VARCHAR(255), updated_at TIMESTAMPTZ DEFAULT NOW());
+                -- Rollup por minuto mantenido por el flusher: las estadísticas
+                -- de ventanas largas agregan ~60 filas/h en vez de miles crudas
+                CREATE TABLE IF NOT EXISTS vital_signs_1min (bucket TIMESTAMPTZ NOT NULL,
+                    patient_id VARCHAR(100) NOT NULL DEFAULT '', n INTEGER,
+                    spo2_sum BIGINT, spo2_min SMALLINT, spo2_max SMALLINT,
+                    hr_sum BIGINT, hr_min SMALLINT, hr_max SMALLINT,
+                    spo2_crit INTEGER, hr_crit INTEGER, PRIMARY KEY (bucket, patient_id));
+                -- Cubriente: la consulta de "últimos 50" y el informe leen solo
+                -- spo2/hr, así que con INCLUDE son index-only scans
+                CREATE INDEX IF NOT EXISTS idx_vital_signs_ts ON vital_signs (timestamp DESC) INCLUDE (spo2, hr);
+                -- BRIN: diminuto y suficiente para acotar rangos en una tabla
+                -- append-only; rangos de 32 páginas afinan el recorte de la
+                -- ventana sin engordar apenas el índice
+                CREATE INDEX IF NOT EXISTS idx_vs_ts_brin ON vital_signs USING BRIN (timestamp) WITH (pages_per_range = 32);
+                CREATE INDEX IF NOT EXISTS idx_vs_pid_ts ON vital_signs (patient_id, timestamp DESC);
+                -- Índice parcial: los agregados de críticos solo tocan filas críticas
+                CREATE INDEX IF NOT EXISTS idx_vs_crit ON vital_signs (timestamp DESC) WHERE spo2_critical OR hr_critical;
+                CREATE INDEX IF NOT EXISTS idx_alerts_ts ON alerts (timestamp DESC, patient_id);
             """)
             conn.commit()
+            _ensure_partitions(conn)
             load_email_config()
     except: conn.rollback()
     finally: release_db_connection(conn)
 
+def _ensure_partitions(conn, days_ahead=2):
+    """Precrea las particiones diarias de hoy y mañana. No-op si vital_signs
+    es una tabla plana (despliegues anteriores a la partición)."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT relkind FROM pg_class WHERE relname = 'vital_signs'")
+            r = cur.fetchone()
+            if not r or r[0] != 'p': return
+            today = datetime.now(timezone.utc).date()
+            for i in range(days_ahead):
+                day = today + timedelta(days=i)
+                name = f"vital_signs_{day:%Y%m%d}"
+                cur.execute(f"""CREATE TABLE IF NOT EXISTS {name} PARTITION OF vital_signs
+                                FOR VALUES FROM ('{day}') TO ('{day + timedelta(days=1)}')""")
+                # Partición caliente: autovacuum agresivo para estadísticas frescas
+                cur.execute(f"ALTER TABLE {name} SET (autovacuum_vacuum_scale_factor = 0.02)")
+            # Red de seguridad para filas fuera de rango (reloj desajustado, backfill)
+            cur.execute("""CREATE TABLE IF NOT EXISTS vital_signs_default
+                           PARTITION OF vital_signs DEFAULT""")
+            conn.commit()
+    except Exception as e:
+        try: conn.rollback()
+        except: pass
+        log.error(f"❌ Creando particiones: {e}")
+
+def _partition_maintainer():
+    """Greenlet nocturno: mantiene creada la partición del día siguiente"""
+    while True:
+        eventlet.sleep(6 * 3600)
+        conn = get_db_connection()
+        if not conn: continue
+        try: _ensure_partitions(conn)
+        finally: release_db_connection(conn)
+
 def load_email_config():
-    global email_config
     conn = get_db_connection()
     if not conn: return
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM email_config ORDER BY updated_at DESC LIMIT 1")
+        with conn.cursor() as cur:
+            # La tabla es un singleton (id=1) desde el UPSERT; el ORDER BY cubre
+            # filas históricas de despliegues anteriores al cambio
+            cur.execute("""SELECT email_to, patient_name, patient_room, patient_residence
+                           FROM email_config ORDER BY updated_at DESC LIMIT 1""")
             r = cur.fetchone()
             if r:
-                email_config = {"email_to": r.get("email_to",""), "patient_name": r.get("patient_name",""),
-                               "patient_room": r.get("patient_room",""), "patient_residence": r.get("patient_residence","")}
-                print(f"✅ Email config: {email_config['email_to']}")
+                email_to, pname, proom, pres = r
+                _set_email_config({"email_to": email_to or "", "patient_name": pname or "",
+                                   "patient_room": proom or "", "patient_residence": pres or ""})
+                log.info(f"✅ Email config: {email_config['email_to']}")
     except: pass
     finally: release_db_connection(conn)
 
@@ -142,33 +439,359 @@ def save_email_config_db(email_to, patient_name, patient_room, patient_residence
     conn = get_db_connection()
     if not conn: return
     try:
+        # Escritura de una sola sentencia: autocommit evita el round-trip del
+        # COMMIT explícito (el servidor confirma al ejecutar)
+        conn.autocommit = True
         with conn.cursor() as cur:
-            cur.execute("INSERT INTO email_config (email_to,patient_name,patient_room,patient_residence) VALUES (%s,%s,%s,%s)",
+            # UPSERT sobre id=1: una sola fila viva en vez de crecimiento sin límite
+            cur.execute("""INSERT INTO email_config (id,email_to,patient_name,patient_room,patient_residence)
+                           VALUES (1,%s,%s,%s,%s)
+                           ON CONFLICT (id) DO UPDATE SET email_to=EXCLUDED.email_to, patient_name=EXCLUDED.patient_name,
+                               patient_room=EXCLUDED.patient_room, patient_residence=EXCLUDED.patient_residence, updated_at=NOW()""",
                        (email_to, patient_name, patient_room, patient_residence))
-            conn.commit()
-    except: conn.rollback()
-    finally: release_db_connection(conn)
+            # Avisar al resto de workers para que recarguen su copia en memoria
+            cur.execute("SELECT pg_notify('email_cfg', %s)", (email_to,))
+    except: pass
+    finally:
+        # La conexión vuelve al pool: restaurar el modo transaccional por defecto
+        try: conn.autocommit = False
+        except: pass
+        release_db_connection(conn)
 
-def save_vital(spo2, hr, spo2_crit, hr_crit, dist, rssi, patient_id):
-    conn = get_db_connection()
-    if not conn: return
+def _config_listener():
+    """LISTEN email_cfg: con varios workers, el que no atendió el POST de
+    configuración se entera por NOTIFY y recarga su copia en memoria al
+    instante, sin sondear la BD"""
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(_dsn())
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("LISTEN email_cfg")
+            while True:
+                # select verde de eventlet: el greenlet duerme hasta que llega
+                # un NOTIFY (el timeout solo detecta conexiones muertas)
+                if select.select([conn], [], [], 30.0)[0]:
+                    conn.poll()
+                    if conn.notifies:
+                        del conn.notifies[:]
+                        load_email_config()
+                        log.info("🔄 Configuración de email recargada por NOTIFY")
+        except Exception as e:
+            log.warning(f"⚠️ Listener de configuración caído, reintento en 10s: {e}")
+            try:
+                if conn: conn.close()
+            except: pass
+            eventlet.sleep(10)
+
+# Ingesta por lotes: receive_data solo encola; un greenlet agrupa filas y
+# las inserta con execute_values (un commit por lote en vez de uno por paquete)
+pending_vitals = deque()
+VITALS_PENDING_MAX = 10000    # Tope del buffer: ~3 h de caída de BD a 1 Hz
+VITALS_FLUSH_INTERVAL = 1.0   # Segundos entre vaciados
+VITALS_FLUSH_MAX = 500        # Filas máximas por vaciado
+VITALS_PAGE_SIZE = 200        # Filas por sentencia multi-VALUES de execute_values
+VITALS_COPY_MIN = 500         # A partir de aquí COPY gana a multi-VALUES (sin parser SQL)
+
+_VITALS_INSERT_SQL = "INSERT INTO vital_signs (spo2,hr,spo2_critical,hr_critical,distance,rssi,patient_id) VALUES %s"
+VITALS_UNNEST_MIN = 50        # Desde aquí UNNEST sobre arrays gana a multi-VALUES
+
+# UNNEST: 7 parámetros array en vez de 7×N escalares; el texto SQL no depende
+# del tamaño del lote, así que el plan se reutiliza entre vaciados
+_VITALS_UNNEST_SQL = """INSERT INTO vital_signs (spo2,hr,spo2_critical,hr_critical,distance,rssi,patient_id)
+                        SELECT * FROM UNNEST(%s::smallint[],%s::smallint[],%s::bool[],%s::bool[],%s::float[],%s::smallint[],%s::text[])"""
+
+# PREPARE en la conexión dedicada del flusher: el servidor parsea y planifica
+# la sentencia UNNEST una vez por conexión en vez de en cada vaciado
+_VITALS_PREPARE_SQL = """PREPARE ins_vitals AS
+    INSERT INTO vital_signs (spo2,hr,spo2_critical,hr_critical,distance,rssi,patient_id)
+    SELECT * FROM UNNEST($1::smallint[],$2::smallint[],$3::bool[],$4::bool[],$5::float[],$6::smallint[],$7::text[])"""
+
+# UPSERT incremental del rollup: cada vaciado suma su lote al minuto en curso
+_ROLLUP_SQL = """INSERT INTO vital_signs_1min AS r
+    (bucket, patient_id, n, spo2_sum, spo2_min, spo2_max, hr_sum, hr_min, hr_max, spo2_crit, hr_crit)
+    VALUES (date_trunc('minute', NOW()), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (bucket, patient_id) DO UPDATE SET
+        n = r.n + EXCLUDED.n,
+        spo2_sum = r.spo2_sum + EXCLUDED.spo2_sum,
+        spo2_min = LEAST(r.spo2_min, EXCLUDED.spo2_min),
+        spo2_max = GREATEST(r.spo2_max, EXCLUDED.spo2_max),
+        hr_sum = r.hr_sum + EXCLUDED.hr_sum,
+        hr_min = LEAST(r.hr_min, EXCLUDED.hr_min),
+        hr_max = GREATEST(r.hr_max, EXCLUDED.hr_max),
+        spo2_crit = r.spo2_crit + EXCLUDED.spo2_crit,
+        hr_crit = r.hr_crit + EXCLUDED.hr_crit"""
+
+def _rollup_rows(cur, rows):
+    """Acumula el lote en vital_signs_1min. El lote normal cubre ~1 s, así que
+    atribuirlo al minuto actual es exacto; al drenar un backlog tras un corte
+    las muestras viejas caen en el minuto del vaciado (impreciso pero acotado)."""
+    groups = {}
+    for spo2, hr, s_crit, h_crit, _dist, _rssi, pid in rows:
+        g = groups.setdefault(pid or "", [0, 0, 999, 0, 0, 999, 0, 0, 0])
+        g[0] += 1
+        g[1] += spo2; g[2] = min(g[2], spo2); g[3] = max(g[3], spo2)
+        g[4] += hr; g[5] = min(g[5], hr); g[6] = max(g[6], hr)
+        g[7] += bool(s_crit); g[8] += bool(h_crit)
+    for pid, g in groups.items():
+        cur.execute(_ROLLUP_SQL, (pid, *g))
+
+def _insert_unnest(cur, rows, prepared=False):
+    cols = tuple(list(c) for c in zip(*rows))
+    if prepared:
+        cur.execute("EXECUTE ins_vitals (%s,%s,%s,%s,%s,%s,%s)", cols)
+    else:
+        cur.execute(_VITALS_UNNEST_SQL, cols)
+
+# COPY binario: sin pasar ints por texto en ninguno de los dos lados. El
+# formato es estricto con los tipos, por eso el flusher detecta al conectar
+# si las columnas son smallint (instalación nueva) o integer (antigua)
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack(">h", -1)
+
+def _copy_binary(cur, rows, int2):
+    ifmt, ilen = (">ih", 2) if int2 else (">ii", 4)
+    pack = struct.pack
+    buf = BytesIO()
+    w = buf.write
+    w(_PGCOPY_HEADER)
+    for spo2, hr, s_crit, h_crit, dist, rssi, pid in rows:
+        w(pack(">h", 7))
+        w(pack(ifmt, ilen, spo2))
+        w(pack(ifmt, ilen, hr))
+        w(pack(">ib", 1, 1 if s_crit else 0))
+        w(pack(">ib", 1, 1 if h_crit else 0))
+        w(pack(">id", 8, float(dist)) if dist is not None else pack(">i", -1))
+        w(pack(ifmt, ilen, rssi) if rssi is not None else pack(">i", -1))
+        if pid is None:
+            w(pack(">i", -1))
+        else:
+            b = pid.encode("utf-8")
+            w(pack(">i", len(b)) + b)
+    w(_PGCOPY_TRAILER)
+    buf.seek(0)
+    cur.copy_expert("COPY vital_signs (spo2,hr,spo2_critical,hr_critical,distance,rssi,patient_id) FROM STDIN WITH (FORMAT BINARY)", buf)
+
+# Última lectura persistida: las repeticiones exactas no críticas dentro de
+# esta ventana no generan fila nueva (los dispositivos BLE repiten valores)
+STORE_DEDUP_WINDOW = 10  # Segundos
+_last_stored = {"spo2": None, "hr": None, "t": 0.0}
+
+# Filas descartadas por buffer lleno (señal de que la BD lleva mucho caída)
+_vitals_dropped = 0
+
+def _enqueue_vital(row):
+    """Encola una fila acotando el buffer: con la BD caída mucho tiempo se
+    descartan las muestras nuevas (aviso cada 1000) antes que agotar la RAM"""
+    global _vitals_dropped
+    if len(pending_vitals) >= VITALS_PENDING_MAX:
+        _vitals_dropped += 1
+        if _vitals_dropped % 1000 == 1:
+            log.warning(f"⚠️ Buffer de vitales lleno ({VITALS_PENDING_MAX}): {_vitals_dropped} muestras descartadas")
+        return False
+    pending_vitals.append(row)
+    return True
+
+# Conexión dedicada del flusher: vive lo que el greenlet, sin locks de pool
+# ni checkout/putconn por lote; se recrea sola si el servidor la cierra
+_flusher_conn = None
+
+def _get_flusher_conn():
+    global _flusher_conn
+    if _flusher_conn is not None and not _flusher_conn.closed:
+        return _flusher_conn
+    if not POSTGRES_AVAILABLE or not DATABASE_URL: return None
+    try:
+        _flusher_conn = psycopg2.connect(_dsn())
+        try:
+            with _flusher_conn.cursor() as cur:
+                cur.execute(_VITALS_PREPARE_SQL)
+            _flusher_conn.commit()
+            _flusher_conn._ins_vitals_prepared = True
+        except Exception:
+            # pgbouncer en modo transacción no soporta PREPARE: seguir sin él
+            _flusher_conn.rollback()
+            _flusher_conn._ins_vitals_prepared = False
+        try:
+            with _flusher_conn.cursor() as cur:
+                cur.execute("""SELECT data_type FROM information_schema.columns
+                               WHERE table_name = 'vital_signs' AND column_name = 'spo2'""")
+                r = cur.fetchone()
+            _flusher_conn.commit()
+            _flusher_conn._vitals_int2 = bool(r and r[0] == 'smallint')
+        except Exception:
+            # Sin detección de tipos no hay COPY binario seguro: queda el CSV
+            _flusher_conn.rollback()
+    except Exception as e:
+        log.error(f"❌ Conexión del flusher: {e}")
+        _flusher_conn = None
+    return _flusher_conn
+
+def _drop_flusher_conn():
+    global _flusher_conn
+    if _flusher_conn is not None:
+        try: _flusher_conn.close()
+        except: pass
+        _flusher_conn = None
+
+# Fallos consecutivos del flusher CON conexión viva: si un mismo lote falla
+# una y otra vez (fila envenenada, cambio de esquema) no puede atascar la
+# ingesta para siempre — se descarta y se contabiliza como perdido
+FLUSH_FAIL_MAX = 3
+_flush_fail_streak = 0
+
+def _flush_pending_vitals():
+    global _flush_fail_streak, _vitals_dropped
+    if not pending_vitals: return
+    rows = []
+    while pending_vitals and len(rows) < VITALS_FLUSH_MAX:
+        rows.append(pending_vitals.popleft())
+    conn = _get_flusher_conn()
+    if not conn:
+        pending_vitals.extendleft(reversed(rows))
+        return
     try:
         with conn.cursor() as cur:
-            cur.execute("INSERT INTO vital_signs (spo2,hr,spo2_critical,hr_critical,distance,rssi,patient_id) VALUES (%s,%s,%s,%s,%s,%s,%s)",
-                       (spo2, hr, spo2_crit, hr_crit, dist, rssi, patient_id))
+            # Telemetría: perder los últimos segundos en un crash es aceptable,
+            # así que el commit no espera el fsync del WAL (solo esta transacción;
+            # alerts y email_config conservan durabilidad completa)
+            cur.execute("SET LOCAL synchronous_commit = off")
+            if len(rows) >= VITALS_COPY_MIN:
+                # Backlog grande (p. ej. tras un corte de red): COPY evita el
+                # parser SQL, y en binario también la conversión int<->texto
+                int2 = getattr(conn, '_vitals_int2', None)
+                if int2 is not None:
+                    _copy_binary(cur, rows, int2)
+                else:
+                    buf = StringIO()
+                    csv.writer(buf).writerows(rows)
+                    buf.seek(0)
+                    cur.copy_expert("COPY vital_signs (spo2,hr,spo2_critical,hr_critical,distance,rssi,patient_id) FROM STDIN WITH CSV", buf)
+            elif len(rows) >= VITALS_UNNEST_MIN:
+                _insert_unnest(cur, rows, prepared=getattr(conn, '_ins_vitals_prepared', False))
+            else:
+                execute_values(cur, _VITALS_INSERT_SQL, rows, page_size=VITALS_PAGE_SIZE)
+            _rollup_rows(cur, rows)
             conn.commit()
-    except: conn.rollback()
-    finally: release_db_connection(conn)
+        _flush_fail_streak = 0
+    except Exception as e:
+        # InterfaceError/OperationalError: descartar y reconectar al siguiente ciclo
+        try: conn.rollback()
+        except: _drop_flusher_conn()
+        _flush_fail_streak += 1
+        if _flush_fail_streak >= FLUSH_FAIL_MAX:
+            _vitals_dropped += len(rows)
+            _flush_fail_streak = 0
+            log.error(f"❌ Lote de {len(rows)} vitales descartado tras {FLUSH_FAIL_MAX} fallos seguidos: {e}")
+        else:
+            pending_vitals.extendleft(reversed(rows))
+
+def _vitals_flusher():
+    while True:
+        eventlet.sleep(VITALS_FLUSH_INTERVAL)
+        try:
+            _flush_pending_vitals()
+            # Backlog acumulado (BD recién recuperada): seguir volcando lotes
+            # completos sin esperar al siguiente tick
+            while len(pending_vitals) >= VITALS_FLUSH_MAX:
+                before = len(pending_vitals)
+                eventlet.sleep(0)  # Ceder el hub entre lotes COPY
+                _flush_pending_vitals()
+                if len(pending_vitals) >= before: break  # Sin progreso: BD caída aún
+            flush_alerts()
+        except Exception as e:
+            log.error(f"❌ Error volcando lotes pendientes: {e}")
+
+# Las alertas también se agrupan: llegan a ráfagas (SpO2 oscilando alrededor
+# del umbral) y una ráfaga de N alertas cuesta una sola transacción
+pending_alerts = deque()
+_ALERTS_INSERT_SQL = "INSERT INTO alerts (alert_type,spo2,hr,message,email_sent,email_to,patient_id) VALUES %s"
 
 def save_alert(alert_type, spo2, hr, msg, sent, email_to, patient_id):
+    if db_pool:
+        pending_alerts.append((alert_type, spo2, hr, msg, sent, email_to, patient_id))
+
+def flush_alerts():
+    """Vuelca las alertas pendientes; con durabilidad completa (a diferencia
+    de la telemetría, aquí sí importa no perder filas en un crash)."""
+    if not pending_alerts: return
+    rows = []
+    while pending_alerts:
+        rows.append(pending_alerts.popleft())
     conn = get_db_connection()
-    if not conn: return
+    if not conn:
+        pending_alerts.extendleft(reversed(rows))
+        return
     try:
         with conn.cursor() as cur:
-            cur.execute("INSERT INTO alerts (alert_type,spo2,hr,message,email_sent,email_to,patient_id) VALUES (%s,%s,%s,%s,%s,%s,%s)",
-                       (alert_type, spo2, hr, msg, sent, email_to, patient_id))
+            execute_values(cur, _ALERTS_INSERT_SQL, rows, page_size=100)
             conn.commit()
-    except: conn.rollback()
+    except:
+        conn.rollback()
+        pending_alerts.extendleft(reversed(rows))
+    finally: release_db_connection(conn)
+
+HISTORY_CACHE_TTL = 3   # Segundos: varios clientes sondean con los mismos args
+HISTORY_CACHE_MAX = 32  # La clave sale de query params: sin tope crecería sin límite
+_history_cache = {}
+
+def _history_cached(key, fetch):
+    """Micro-caché TTL para las consultas de histórico (mismo patrón que stats)"""
+    now = time.time()
+    hit = _history_cache.get(key)
+    if hit and hit[0] > now:
+        return hit[1]
+    result = fetch()
+    if len(_history_cache) >= HISTORY_CACHE_MAX:
+        _history_cache.pop(min(_history_cache, key=lambda k: _history_cache[k][0]))
+    _history_cache[key] = (now + HISTORY_CACHE_TTL, result)
+    return result
+
+def get_vital_signs(limit=1000, hours=24):
+    return _history_cached(("vitals", limit, hours), lambda: _query_vital_signs(limit, hours))
+
+def get_alerts_history(limit=100, hours=24):
+    return _history_cached(("alerts", limit, hours), lambda: _query_alerts_history(limit, hours))
+
+def _query_vital_signs(limit=1000, hours=24):
+    """Histórico de constantes; el timestamp llega ya en ISO desde SQL (to_char)"""
+    conn = get_db_connection()
+    if not conn: return []
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # make_interval parametrizado: mismo texto SQL para cualquier ventana,
+            # con lo que el plan se reutiliza en vez de re-planificarse por valor
+            cur.execute("""
+                SELECT id, to_char(timestamp AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS') AS timestamp,
+                       spo2, hr, spo2_critical, hr_critical, distance, rssi, patient_id
+                FROM vital_signs
+                WHERE timestamp > NOW() - make_interval(hours => %s)
+                ORDER BY timestamp DESC LIMIT %s
+            """, (hours, limit))
+            return cur.fetchall()
+    except Exception as e:
+        log.error(f"❌ Error consultando PostgreSQL: {e}")
+        return []
+    finally: release_db_connection(conn)
+
+def _query_alerts_history(limit=100, hours=24):
+    """Histórico de alertas; mismo formateo de timestamp en SQL"""
+    conn = get_db_connection()
+    if not conn: return []
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT id, to_char(timestamp AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS') AS timestamp,
+                       alert_type, spo2, hr, email_sent, email_to, patient_id
+                FROM alerts
+                WHERE timestamp > NOW() - make_interval(hours => %s)
+                ORDER BY timestamp DESC LIMIT %s
+            """, (hours, limit))
+            return cur.fetchall()
+    except Exception as e:
+        log.error(f"❌ Error consultando alertas: {e}")
+        return []
     finally: release_db_connection(conn)
 
 # ============================================================
@@ -185,35 +808,36 @@ def classify_spo2_episodes(spo2_list, hr_list, threshold=92):
     """
     MIN_SAMPLES = 30
     MIN_HR_VARIATION = 5
-    
-    clinical = 0
-    artifacts = 0
-    buffer = []
 
-    for s, h in zip(spo2_list, hr_list):
-        if s < threshold:
-            buffer.append((s, h))
-        else:
-            if buffer:
-                duration = len(buffer)
-                hr_values = [x[1] for x in buffer]
-                hr_var = max(hr_values) - min(hr_values) if hr_values else 0
-                
-                if duration >= MIN_SAMPLES and hr_var > MIN_HR_VARIATION:
-                    clinical += 1
-                else:
-                    artifacts += 1
-                buffer = []
-    
-    if buffer:
-        duration = len(buffer)
-        hr_values = [x[1] for x in buffer]
-        hr_var = max(hr_values) - min(hr_values) if hr_values else 0
-        if duration >= MIN_SAMPLES and hr_var > MIN_HR_VARIATION:
-            clinical += 1
-        else:
-            artifacts += 1
-    
+    spo2 = np.asarray(spo2_list)
+    hr = np.asarray(hr_list)
+    if spo2.size == 0:
+        return 0, 0
+
+    # Detección de segmentos vectorizada: los bordes de la máscara marcan
+    # inicio/fin de cada episodio sin recorrer muestra a muestra en Python
+    mask = spo2 < threshold
+    edges = np.diff(mask.astype(np.int8))
+    starts = np.where(edges == 1)[0] + 1
+    ends = np.where(edges == -1)[0] + 1
+    if mask[0]:
+        starts = np.concatenate(([0], starts))
+    if mask[-1]:
+        ends = np.concatenate((ends, [mask.size]))
+    if starts.size == 0:
+        return 0, 0
+
+    durations = ends - starts
+    # Variación de HR por episodio: reduceat sobre pares (inicio, fin); el
+    # padding final hace válido el índice fin == len(hr) del último episodio
+    hr_pad = np.concatenate((hr, hr[-1:]))
+    bounds = np.empty(starts.size * 2, dtype=np.intp)
+    bounds[0::2], bounds[1::2] = starts, ends
+    hr_var = (np.maximum.reduceat(hr_pad, bounds)[0::2]
+              - np.minimum.reduceat(hr_pad, bounds)[0::2])
+
+    clinical = int(np.sum((durations >= MIN_SAMPLES) & (hr_var > MIN_HR_VARIATION)))
+    artifacts = int(starts.size) - clinical
     return clinical, artifacts
 
 
@@ -222,16 +846,14 @@ def get_8hour_periods(hours=24):
     Obtiene estadísticas por períodos de 8 horas.
     Retorna lista de diccionarios con stats de cada período.
     """
-    from collections import defaultdict
-    
     if not db_pool:
         # Sin base de datos: usar datos en memoria (sesión actual)
         if not spo2_hist or len(spo2_hist) < 10:
             return []
         
         # Simular un único período con los datos actuales
-        spo2_arr = np.array(list(spo2_hist))
-        hr_arr = np.array(list(hr_hist))
+        spo2_arr = spo2_hist.ordered()
+        hr_arr = hr_hist.ordered()
         now = datetime.now(timezone.utc)
         
         return [{
@@ -253,65 +875,34 @@ def get_8hour_periods(hours=24):
         return []
     
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(f"""
-                SELECT spo2, hr, timestamp 
-                FROM vital_signs 
-                WHERE timestamp > NOW() - INTERVAL '{hours} hours'
-                ORDER BY timestamp ASC
-            """)
-            rows = cur.fetchall()
-            
-            if not rows:
-                return []
-            
-            # Agrupar por períodos de 8 horas
-            periods = defaultdict(list)
-            
-            for row in rows:
-                ts = row['timestamp']
-                hour = ts.hour
-                if hour < 8:
-                    period_name = "Noche (00:00-08:00)"
-                elif hour < 16:
-                    period_name = "Mañana (08:00-16:00)"
-                else:
-                    period_name = "Tarde (16:00-24:00)"
-                
-                key = f"{ts.strftime('%Y-%m-%d')}_{period_name}"
-                periods[key].append({
-                    'spo2': row['spo2'],
-                    'hr': row['hr'],
-                    'timestamp': ts,
-                    'period_name': period_name
-                })
-            
-            result = []
-            for key, data in sorted(periods.items()):
-                if len(data) < 5:
-                    continue
-                    
-                spo2_vals = [d['spo2'] for d in data]
-                hr_vals = [d['hr'] for d in data]
-                
-                result.append({
-                    "period_name": data[0]['period_name'],
-                    "date": data[0]['timestamp'].strftime("%Y-%m-%d"),
-                    "start": data[0]['timestamp'].strftime("%H:%M"),
-                    "end": data[-1]['timestamp'].strftime("%H:%M"),
-                    "samples": len(data),
-                    "spo2_min": int(np.min(spo2_vals)),
-                    "spo2_max": int(np.max(spo2_vals)),
-                    "spo2_avg": round(float(np.mean(spo2_vals)), 1),
-                    "hr_min": int(np.min(hr_vals)),
-                    "hr_max": int(np.max(hr_vals)),
-                    "hr_avg": round(float(np.mean(hr_vals)), 1),
-                })
-            
-            return result
-            
+        with conn.cursor() as cur:
+            # Agregación en SQL: el GROUP BY colapsa la ventana a ~3 filas por
+            # día en el servidor en vez de enviar cada muestra y agrupar aquí
+            cur.execute("""
+                SELECT date_trunc('day', timestamp)::date,
+                       (EXTRACT(hour FROM timestamp)::int / 8),
+                       COUNT(*),
+                       MIN(spo2), MAX(spo2), ROUND(AVG(spo2)::numeric, 1),
+                       MIN(hr), MAX(hr), ROUND(AVG(hr)::numeric, 1),
+                       MIN(timestamp), MAX(timestamp)
+                FROM vital_signs
+                WHERE timestamp > NOW() - make_interval(hours => %s)
+                GROUP BY 1, 2
+                HAVING COUNT(*) >= 5
+                ORDER BY 1, 2
+            """, (hours,))
+            labels = ("Noche (00:00-08:00)", "Mañana (08:00-16:00)", "Tarde (16:00-24:00)")
+            return [{
+                "period_name": labels[period],
+                "date": day.strftime("%Y-%m-%d"),
+                "start": ts_min.strftime("%H:%M"),
+                "end": ts_max.strftime("%H:%M"),
+                "samples": n,
+                "spo2_min": s_min, "spo2_max": s_max, "spo2_avg": float(s_avg),
+                "hr_min": h_min, "hr_max": h_max, "hr_avg": float(h_avg),
+            } for day, period, n, s_min, s_max, s_avg, h_min, h_max, h_avg, ts_min, ts_max in cur]
     except Exception as e:
-        print(f"[ERROR] get_8hour_periods: {e}")
+        log.error(f"[ERROR] get_8hour_periods: {e}")
         return []
     finally:
         release_db_connection(conn)
@@ -319,14 +910,17 @@ def get_8hour_periods(hours=24):
 
 def calculate_trend(values):
     """Calcula tendencia temporal: mejorando, estable, empeorando."""
-    if not values or len(values) < 6:
+    if values is None or len(values) < 6:
         return "Datos insuficientes"
     
-    mid = len(values) // 2
-    first_half = np.mean(values[:mid])
-    second_half = np.mean(values[mid:])
-    
-    diff = second_half - first_half
+    # Una sola pasada completa: la media de la segunda mitad sale de
+    # total - primera mitad en vez de recorrer el array dos veces
+    n = len(values)
+    mid = n // 2
+    arr = np.asarray(values)
+    total = int(arr.sum(dtype=np.int64))
+    first = int(arr[:mid].sum(dtype=np.int64))
+    diff = (total - first) / (n - mid) - first / mid
     
     if abs(diff) < 1:
         return "Estable"
@@ -426,18 +1020,14 @@ def get_vital_signs_for_report(hours=24):
     """Obtiene datos vitales para el informe"""
     if not db_pool:
         if not spo2_hist: return None
-        # Crear lista de últimos 50 valores con timestamp simulado
-        last_50 = []
+        # Timestamps ya formateados en el ingest (ts_hist): solo copiar
         now = datetime.now(timezone.utc)
-        for i, (s, h) in enumerate(zip(list(spo2_hist)[-50:], list(hr_hist)[-50:])):
-            last_50.append({
-                "timestamp": (now - timedelta(seconds=(50-i))).strftime("%H:%M:%S"),
-                "spo2": s,
-                "hr": h
-            })
+        spo2_list, hr_list, _ = get_hist_snapshot()
+        last_50 = [{"timestamp": t, "spo2": s, "hr": h}
+                   for t, s, h in zip(list(ts_hist)[-50:], spo2_list[-50:], hr_list[-50:])]
         return {
-            "spo2_list": list(spo2_hist),
-            "hr_list": list(hr_hist),
+            "spo2_list": spo2_list,
+            "hr_list": hr_list,
             "timestamp_start": "Sesión actual",
             "timestamp_end": now.strftime("%Y-%m-%d %H:%M:%S UTC"),
             "total_samples": len(spo2_hist),
@@ -447,89 +1037,152 @@ def get_vital_signs_for_report(hours=24):
     conn = get_db_connection()
     if not conn: return None
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Obtener todos los datos del período
-            cur.execute(f"""
-                SELECT spo2, hr, timestamp 
-                FROM vital_signs 
-                WHERE timestamp > NOW() - INTERVAL '{hours} hours'
+        # Cursor de servidor: la ventana completa se consume por trozos y se
+        # vuelca directamente a arrays NumPy, sin materializar el resultado
+        # entero en el búfer de psycopg2 ni en listas de ints Python
+        chunks_s, chunks_h = [], []
+        with conn.cursor(name='vs_report') as cur:
+            cur.itersize = 10000
+            # ::int2 también en instalaciones antiguas con columnas INTEGER:
+            # la mitad de bytes por valor en el cable para el escaneo grande
+            cur.execute("""
+                SELECT spo2::int2, hr::int2
+                FROM vital_signs
+                WHERE timestamp > NOW() - make_interval(hours => %s)
                 ORDER BY timestamp ASC
-            """)
-            rows = cur.fetchall()
-            if not rows: return None
-            
-            # Obtener últimos 50 registros
+            """, (hours,))
+            while True:
+                batch = cur.fetchmany(10000)
+                if not batch: break
+                arr = np.array(batch, dtype=np.int16)
+                chunks_s.append(arr[:, 0])
+                chunks_h.append(arr[:, 1])
+        if not chunks_s: return None
+        spo2_arr = np.concatenate(chunks_s)
+        hr_arr = np.concatenate(chunks_h)
+
+        with conn.cursor() as cur:
+            # Extremos del período y últimos 50 en una sola fila: json_agg
+            # monta la lista de dicts en el servidor y psycopg2 la entrega
+            # ya parseada, sin construir 50 objetos aquí
             cur.execute("""
-                SELECT spo2, hr, timestamp 
-                FROM vital_signs 
-                ORDER BY timestamp DESC 
-                LIMIT 50
-            """)
-            last_50_rows = cur.fetchall()
-            last_50_rows.reverse()  # Ordenar cronológicamente
-            
-            last_50 = []
-            for r in last_50_rows:
-                last_50.append({
-                    "timestamp": r['timestamp'].strftime("%Y-%m-%d %H:%M:%S"),
-                    "spo2": r['spo2'],
-                    "hr": r['hr']
-                })
-            
+                WITH m AS (SELECT to_char(min(timestamp), 'YYYY-MM-DD HH24:MI:SS "UTC"') AS ts_start,
+                                  to_char(max(timestamp), 'YYYY-MM-DD HH24:MI:SS "UTC"') AS ts_end
+                           FROM vital_signs WHERE timestamp > NOW() - make_interval(hours => %s)),
+                     l AS (SELECT json_agg(json_build_object(
+                                      'timestamp', to_char(timestamp, 'YYYY-MM-DD HH24:MI:SS'),
+                                      'spo2', spo2, 'hr', hr) ORDER BY timestamp ASC) AS readings
+                           FROM (SELECT spo2, hr, timestamp FROM vital_signs
+                                 ORDER BY timestamp DESC LIMIT 50) t)
+                SELECT m.ts_start, m.ts_end, l.readings FROM m, l
+            """, (hours,))
+            ts_start, ts_end, last_50 = cur.fetchone()
+            last_50 = last_50 or []
+
             return {
-                "spo2_list": [r['spo2'] for r in rows],
-                "hr_list": [r['hr'] for r in rows],
-                "timestamp_start": rows[0]['timestamp'].strftime("%Y-%m-%d %H:%M:%S UTC"),
-                "timestamp_end": rows[-1]['timestamp'].strftime("%Y-%m-%d %H:%M:%S UTC"),
-                "total_samples": len(rows),
+                "spo2_list": spo2_arr,
+                "hr_list": hr_arr,
+                "timestamp_start": ts_start,
+                "timestamp_end": ts_end,
+                "total_samples": int(spo2_arr.size),
                 "last_50_readings": last_50
             }
     except Exception as e:
-        print(f"[ERROR] get_vital_signs_for_report: {e}")
+        log.error(f"[ERROR] get_vital_signs_for_report: {e}")
         return None
     finally:
         release_db_connection(conn)
 
+# Memoización del análisis del informe: clave (horas, última fila insertada),
+# de modo que solo se recalcula si entraron datos nuevos o venció la TTL
+ANALYSIS_CACHE_TTL = 60
+_analysis_cache = {}
+
+def _last_vital_id():
+    conn = get_db_connection()
+    if not conn: return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT max(id) FROM vital_signs")
+            return cur.fetchone()[0]
+    except: return None
+    finally: release_db_connection(conn)
+
 def process_data_for_analysis(hours=24):
     """Procesa datos y genera estadísticas para el informe - VERSIÓN MEJORADA"""
+    key = (hours, _last_vital_id()) if db_pool else None
+    if key:
+        hit = _analysis_cache.get(key)
+        if hit and hit[0] > time.time():
+            return hit[1]
+    summary = _compute_analysis(hours)
+    if key and summary:
+        _analysis_cache.clear()
+        _analysis_cache[key] = (time.time() + ANALYSIS_CACHE_TTL, summary)
+    return summary
+
+def _hist_stats(arr, maxval=256):
+    """Estadísticas fusionadas vía histograma: SpO2/HR caben en 0..255, así
+    que un bincount + cumsum da media, desvío, mín/máx, percentiles y
+    recuentos por umbral en dos pasadas sobre el array en vez de siete."""
+    counts = np.bincount(arr, minlength=maxval).astype(np.int64)
+    csum = np.cumsum(counts)
+    n = int(csum[-1])
+    vals = np.arange(counts.size, dtype=np.int64)
+    s = int((counts * vals).sum())
+    s2 = int((counts * vals * vals).sum())
+    mean = s / n
+    var = max(s2 / n - mean * mean, 0.0)
+    nz = np.flatnonzero(counts)
+    return counts, csum, n, mean, var ** 0.5, int(nz[0]), int(nz[-1])
+
+def _compute_analysis(hours=24):
     data = get_vital_signs_for_report(hours)
-    if not data or not data["spo2_list"]:
+    if not data or len(data["spo2_list"]) == 0:
         return None
 
-    spo2 = np.array(data["spo2_list"])
-    hr = np.array(data["hr_list"])
+    # En la rama con DB ya llegan como arrays; asarray no copia en ese caso
+    spo2 = np.asarray(data["spo2_list"])
+    hr = np.asarray(data["hr_list"])
 
     clinical, artifacts = classify_spo2_episodes(data["spo2_list"], data["hr_list"])
-    
+
     # Obtener períodos de 8 horas
     periods_8h = get_8hour_periods(hours)
-    
+
     # Calcular tendencias
     trend_spo2 = calculate_trend(data["spo2_list"])
     trend_hr = calculate_trend(data["hr_list"])
 
+    # Todos los agregados salen de un histograma por señal (ver _hist_stats);
+    # el percentil 5 es por rango (primer valor cuya frecuencia acumulada
+    # alcanza el 5 %), equivalente clínico del interpolado de np.percentile
+    _, s_csum, n, s_mean, s_std, s_min, s_max = _hist_stats(spo2)
+    _, h_csum, _, h_mean, h_std, h_min, h_max = _hist_stats(hr)
+    p5 = int(np.searchsorted(s_csum, -(-n * 5 // 100) or 1))
+
     summary = {
         "timestamp_start": data["timestamp_start"],
         "timestamp_end": data["timestamp_end"],
         "total_samples": data["total_samples"],
         # SpO2
-        "spo2_avg": round(float(np.mean(spo2)), 1),
-        "spo2_min": int(np.min(spo2)),
-        "spo2_max": int(np.max(spo2)),
-        "spo2_p5": int(np.percentile(spo2, 5)),
-        "spo2_std": round(float(np.std(spo2)), 2),
-        "spo2_below_90": int(np.sum(spo2 < 90)),
-        "spo2_below_92": int(np.sum(spo2 < 92)),
+        "spo2_avg": round(s_mean, 1),
+        "spo2_min": s_min,
+        "spo2_max": s_max,
+        "spo2_p5": p5,
+        "spo2_std": round(s_std, 2),
+        "spo2_below_90": int(s_csum[89]),
+        "spo2_below_92": int(s_csum[91]),
         "spo2_clinical_events": clinical,
         "spo2_artifact_events": artifacts,
         "spo2_trend": trend_spo2,
         # HR
-        "hr_avg": round(float(np.mean(hr)), 1),
-        "hr_min": int(np.min(hr)),
-        "hr_max": int(np.max(hr)),
-        "hr_std": round(float(np.std(hr)), 2),
-        "hr_bradycardia": int(np.sum(hr < 60)),
-        "hr_tachycardia": int(np.sum(hr > 100)),
+        "hr_avg": round(h_mean, 1),
+        "hr_min": h_min,
+        "hr_max": h_max,
+        "hr_std": round(h_std, 2),
+        "hr_bradycardia": int(h_csum[59]),
+        "hr_tachycardia": int(n - h_csum[100]),
         "hr_trend": trend_hr,
         # Períodos de 8 horas
         "periods_8h": periods_8h,
@@ -542,19 +1195,64 @@ def process_data_for_analysis(hours=24):
     
     return summary
 
+STATS_CACHE_TTL = 10  # Segundos: el dashboard sondea /api/data/statistics
+_stats_cache = {}
+# Generación de críticos: se incrementa al entrar una muestra crítica, de modo
+# que una ráfaga de alertas vea stats frescas sin esperar a que venza la TTL
+_stats_generation = 0
+
 def get_statistics(hours=24):
-    """Estadísticas básicas"""
+    """Estadísticas básicas (memoizadas con TTL corta por ventana de horas)"""
+    key = (hours, _stats_generation)
+    cached = _stats_cache.get(key)
+    if cached and cached[0] > time.time():
+        return cached[1]
+    result = _compute_statistics(hours)
+    if result:
+        _stats_cache.clear()  # Las entradas de generaciones anteriores ya no sirven
+        _stats_cache[key] = (time.time() + STATS_CACHE_TTL, result)
+    return result
+
+def _compute_statistics(hours=24):
     if not db_pool:
-        if not spo2_hist: return None
-        return {"total_samples": len(spo2_hist), "spo2_avg": round(sum(spo2_hist)/len(spo2_hist),2),
-                "spo2_min": min(spo2_hist), "spo2_max": max(spo2_hist),
-                "hr_avg": round(sum(hr_hist)/len(hr_hist),2) if hr_hist else 0,
-                "hr_min": min(hr_hist) if hr_hist else 0, "hr_max": max(hr_hist) if hr_hist else 0}
+        if not _spo2_run.n: return None
+        # Acumuladores de sesión (Welford en el ingest): sin pasada por arrays
+        s, h = _spo2_run, _hr_run
+        return {"total_samples": s.n, "spo2_avg": round(s.mean, 2),
+                "spo2_min": s.mn, "spo2_max": s.mx,
+                "hr_avg": round(h.mean, 2), "hr_min": h.mn, "hr_max": h.mx,
+                "spo2_critical_count": s.crit, "hr_critical_count": h.crit}
     conn = get_db_connection()
     if not conn: return None
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(f"SELECT COUNT(*) as total_samples, ROUND(AVG(spo2)::numeric,2) as spo2_avg, MIN(spo2) as spo2_min, MAX(spo2) as spo2_max, ROUND(AVG(hr)::numeric,2) as hr_avg, MIN(hr) as hr_min, MAX(hr) as hr_max FROM vital_signs WHERE timestamp > NOW() - INTERVAL '{hours} hours'")
+            # Primero el rollup por minuto (~60 filas/h); las muestras aún sin
+            # volcar son como mucho el último segundo, irrelevante para stats
+            cur.execute("""SELECT SUM(n)::int as total_samples,
+                           ROUND(SUM(spo2_sum)::numeric / NULLIF(SUM(n),0), 2) as spo2_avg,
+                           MIN(spo2_min) as spo2_min, MAX(spo2_max) as spo2_max,
+                           ROUND(SUM(hr_sum)::numeric / NULLIF(SUM(n),0), 2) as hr_avg,
+                           MIN(hr_min) as hr_min, MAX(hr_max) as hr_max,
+                           SUM(spo2_crit)::int as spo2_critical_count,
+                           SUM(hr_crit)::int as hr_critical_count
+                           FROM vital_signs_1min WHERE bucket > NOW() - make_interval(hours => %s)""", (hours,))
+            r = cur.fetchone()
+            if r and r['total_samples']:
+                # El rollup solo acumula desde que se desplegó: en una instalación
+                # actualizada puede haber filas crudas de la ventana anteriores a
+                # su primer bucket, y el agregado sería parcial. Sonda barata
+                # (LIMIT 1 por índice) antes de fiarse de él
+                cur.execute("""SELECT EXISTS (SELECT 1 FROM vital_signs
+                               WHERE timestamp > NOW() - make_interval(hours => %s)
+                                 AND timestamp < (SELECT MIN(bucket) FROM vital_signs_1min)) AS gap""", (hours,))
+                if not cur.fetchone()['gap']:
+                    return dict(r)
+            # Rollup vacío o incompleto (histórico anterior al rollup): agregar sobre crudo
+            cur.execute("""SELECT COUNT(*) as total_samples, ROUND(AVG(spo2)::numeric,2) as spo2_avg, MIN(spo2) as spo2_min, MAX(spo2) as spo2_max,
+                           ROUND(AVG(hr)::numeric,2) as hr_avg, MIN(hr) as hr_min, MAX(hr) as hr_max,
+                           COUNT(*) FILTER (WHERE spo2_critical) as spo2_critical_count,
+                           COUNT(*) FILTER (WHERE hr_critical) as hr_critical_count
+                           FROM vital_signs WHERE timestamp > NOW() - make_interval(hours => %s)""", (hours,))
             return dict(cur.fetchone() or {})
     except: return None
     finally: release_db_connection(conn)
@@ -578,31 +1276,85 @@ PRINCIPIOS:
 Devuelve siempre HTML válido y completo, sin explicaciones ni bloques de código markdown."""
 
 
+# Cuerpo dinámico del prompt: plantilla precompilada una sola vez al importar.
+# string.Template no admite especificadores de formato, así que los campos con
+# formato ({:,}, {:.2f}) se calculan antes de la sustitución.
+_PROMPT_TEMPLATE = string.Template("""Genera un informe médico profesional en HTML completo y válido.
+
+══════════════════════════════════════════════════════════════
+DATOS DEL PACIENTE
+══════════════════════════════════════════════════════════════
+• Nombre: $name
+• Edad: $age años
+• Residencia: $residence
+• Habitación: $room
+$patient_context
+
+══════════════════════════════════════════════════════════════
+PERÍODO DE MONITORIZACIÓN
+══════════════════════════════════════════════════════════════
+• Inicio: $timestamp_start
+• Fin: $timestamp_end
+• Duración: $total_samples muestras (~$minutes minutos)
+• Dispositivo: Pulsioxímetro HUMANS (precisión ±2% SpO2, ±3 bpm)
+
+══════════════════════════════════════════════════════════════
+SATURACIÓN DE OXÍGENO (SpO2)
+══════════════════════════════════════════════════════════════
+• Media: $spo2_avg%
+• Mínima: $spo2_min% | Máxima: $spo2_max%
+• Percentil 5: $spo2_p5%
+• Desviación estándar: $spo2_std%
+• Tendencia: $spo2_trend
+• Muestras < 90%: $spo2_below_90 ($pct_below_90%)
+• Muestras < 92%: $spo2_below_92 ($pct_below_92%)
+
+══════════════════════════════════════════════════════════════
+FRECUENCIA CARDÍACA (FC)
+══════════════════════════════════════════════════════════════
+• Media: $hr_avg bpm
+• Mínima: $hr_min bpm | Máxima: $hr_max bpm
+• Desviación estándar: $hr_std bpm
+• Tendencia: $hr_trend
+• Bradicardia (<60 bpm): $hr_bradycardia muestras
+• Taquicardia (>100 bpm): $hr_tachycardia muestras
+
+══════════════════════════════════════════════════════════════
+ANÁLISIS CLÍNICO DE EVENTOS
+══════════════════════════════════════════════════════════════
+• Eventos clínicos de hipoxemia sostenida: $spo2_clinical_events
+• Artefactos de señal (descensos transitorios): $spo2_artifact_events
+
+NOTA: Los artefactos son descensos breves (<30s) por movimiento del sensor,
+SIN correlación con cambios en frecuencia cardíaca. NO representan hipoxemia clínica.
+$risk_info
+$periods_table
+$last_10_table""")
+
+_PERIODS_HEADER = ("\n## ANÁLISIS POR PERÍODOS DE 8 HORAS:\n"
+                   "| Período | Fecha | Muestras | SpO2 Mín | SpO2 Máx | SpO2 Prom | FC Mín | FC Máx | FC Prom |\n"
+                   "|---------|-------|----------|----------|----------|-----------|--------|--------|--------|")
+
+
 def generate_llm_prompt(summary, patient):
     """Genera prompt profesional para el informe médico - VERSIÓN 2.0"""
     now_utc = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-    
-    # Formatear tabla de períodos de 8 horas
+
+    # Tabla de períodos de 8 horas: join sobre lista en vez de += cuadrático
     periods_table = ""
     if summary.get('periods_8h'):
-        periods_table = "\n## ANÁLISIS POR PERÍODOS DE 8 HORAS:\n"
-        periods_table += "| Período | Fecha | Muestras | SpO2 Mín | SpO2 Máx | SpO2 Prom | FC Mín | FC Máx | FC Prom |\n"
-        periods_table += "|---------|-------|----------|----------|----------|-----------|--------|--------|--------|\n"
-        for p in summary['periods_8h']:
-            date_str = p.get('date', 'N/A')
-            periods_table += f"| {p['period_name']} | {date_str} | {p['samples']} | {p['spo2_min']}% | {p['spo2_max']}% | {p['spo2_avg']}% | {p['hr_min']} | {p['hr_max']} | {p['hr_avg']} |\n"
-    
-    # Formatear últimos 10 registros
+        rows = [f"| {p['period_name']} | {p.get('date', 'N/A')} | {p['samples']} | {p['spo2_min']}% | {p['spo2_max']}% | {p['spo2_avg']}% | {p['hr_min']} | {p['hr_max']} | {p['hr_avg']} |"
+                for p in summary['periods_8h']]
+        periods_table = _PERIODS_HEADER + "\n" + "\n".join(rows) + "\n"
+
+    # Últimos 10 registros (la v1.9.0 redujo 50→10 por eficiencia de tokens)
     last_10_table = ""
     last_10 = summary.get('last_10_readings', [])
     if last_10:
-        last_10_table = "\n## ÚLTIMOS 10 REGISTROS:\n"
-        last_10_table += "| # | Timestamp | SpO2 | FC |\n"
-        for i, r in enumerate(last_10, 1):
-            spo2_mark = " ⚠️" if r['spo2'] < 92 else ""
-            hr_mark = " ⚠️" if r['hr'] < 60 or r['hr'] > 100 else ""
-            last_10_table += f"| {i} | {r['timestamp']} | {r['spo2']}%{spo2_mark} | {r['hr']} bpm{hr_mark} |\n"
-    
+        rows = [f"| {i} | {r['timestamp']} | {r['spo2']}%{' ⚠️' if r['spo2'] < 92 else ''} | {r['hr']} bpm{' ⚠️' if r['hr'] < 60 or r['hr'] > 100 else ''} |"
+                for i, r in enumerate(last_10, 1)]
+        last_10_table = "\n## ÚLTIMOS 10 REGISTROS:\n| # | Timestamp | SpO2 | FC |\n" + "\n".join(rows) + "\n"
+
     # Información de riesgo
     risk = summary.get('risk', {})
     risk_info = f"""
@@ -626,58 +1378,38 @@ def generate_llm_prompt(summary, patient):
         except:
             pass
 
-    return f"""Genera un informe médico profesional en HTML completo y válido.
-
-══════════════════════════════════════════════════════════════
-DATOS DEL PACIENTE
-══════════════════════════════════════════════════════════════
-• Nombre: {patient.get('name', 'No especificado')}
-• Edad: {patient.get('age', 'No especificado')} años
-• Residencia: {patient.get('residence', 'No especificado')}
-• Habitación: {patient.get('room', 'No especificado')}
-{patient_context}
-
-══════════════════════════════════════════════════════════════
-PERÍODO DE MONITORIZACIÓN
-══════════════════════════════════════════════════════════════
-• Inicio: {summary['timestamp_start']}
-• Fin: {summary['timestamp_end']}
-• Duración: {summary['total_samples']:,} muestras (~{max(1, summary['total_samples']//60)} minutos)
-• Dispositivo: Pulsioxímetro HUMANS (precisión ±2% SpO2, ±3 bpm)
-
-══════════════════════════════════════════════════════════════
-SATURACIÓN DE OXÍGENO (SpO2)
-══════════════════════════════════════════════════════════════
-• Media: {summary['spo2_avg']}%
-• Mínima: {summary['spo2_min']}% | Máxima: {summary['spo2_max']}%
-• Percentil 5: {summary['spo2_p5']}%
-• Desviación estándar: {summary['spo2_std']}%
-• Tendencia: {summary.get('spo2_trend', 'N/A')}
-• Muestras < 90%: {summary['spo2_below_90']} ({100*summary['spo2_below_90']/max(summary['total_samples'],1):.2f}%)
-• Muestras < 92%: {summary['spo2_below_92']} ({100*summary['spo2_below_92']/max(summary['total_samples'],1):.2f}%)
-
-══════════════════════════════════════════════════════════════
-FRECUENCIA CARDÍACA (FC)
-══════════════════════════════════════════════════════════════
-• Media: {summary['hr_avg']} bpm
-• Mínima: {summary['hr_min']} bpm | Máxima: {summary['hr_max']} bpm
-• Desviación estándar: {summary['hr_std']} bpm
-• Tendencia: {summary.get('hr_trend', 'N/A')}
-• Bradicardia (<60 bpm): {summary['hr_bradycardia']} muestras
-• Taquicardia (>100 bpm): {summary['hr_tachycardia']} muestras
-
-══════════════════════════════════════════════════════════════
-ANÁLISIS CLÍNICO DE EVENTOS
-══════════════════════════════════════════════════════════════
-• Eventos clínicos de hipoxemia sostenida: {summary['spo2_clinical_events']}
-• Artefactos de señal (descensos transitorios): {summary['spo2_artifact_events']}
-
-NOTA: Los artefactos son descensos breves (<30s) por movimiento del sensor, 
-SIN correlación con cambios en frecuencia cardíaca. NO representan hipoxemia clínica.
-{risk_info}
-{periods_table}
-{last_10_table}
-══════════════════════════════════════════════════════════════
+    total = max(summary['total_samples'], 1)
+    return _PROMPT_TEMPLATE.substitute(
+        name=patient.get('name', 'No especificado'),
+        age=patient.get('age', 'No especificado'),
+        residence=patient.get('residence', 'No especificado'),
+        room=patient.get('room', 'No especificado'),
+        patient_context=patient_context,
+        timestamp_start=summary['timestamp_start'],
+        timestamp_end=summary['timestamp_end'],
+        total_samples=f"{summary['total_samples']:,}",
+        minutes=max(1, summary['total_samples'] // 60),
+        spo2_avg=summary['spo2_avg'], spo2_min=summary['spo2_min'],
+        spo2_max=summary['spo2_max'], spo2_p5=summary['spo2_p5'],
+        spo2_std=summary['spo2_std'], spo2_trend=summary.get('spo2_trend', 'N/A'),
+        spo2_below_90=summary['spo2_below_90'],
+        pct_below_90=f"{100 * summary['spo2_below_90'] / total:.2f}",
+        spo2_below_92=summary['spo2_below_92'],
+        pct_below_92=f"{100 * summary['spo2_below_92'] / total:.2f}",
+        hr_avg=summary['hr_avg'], hr_min=summary['hr_min'],
+        hr_max=summary['hr_max'], hr_std=summary['hr_std'],
+        hr_trend=summary.get('hr_trend', 'N/A'),
+        hr_bradycardia=summary['hr_bradycardia'],
+        hr_tachycardia=summary['hr_tachycardia'],
+        spo2_clinical_events=summary['spo2_clinical_events'],
+        spo2_artifact_events=summary['spo2_artifact_events'],
+        risk_info=risk_info, periods_table=periods_table,
+        last_10_table=last_10_table,
+    ) + PROMPT_STRUCTURE_TAIL.format(now_utc=now_utc)
+
+# Cola estática del prompt: se construye una sola vez al importar. Un prefijo
+# estable además mejora la tasa de acierto del prompt-caching del proveedor.
+PROMPT_STRUCTURE_TAIL = f"""══════════════════════════════════════════════════════════════
 ESTRUCTURA DEL INFORME HTML
 ══════════════════════════════════════════════════════════════
 
@@ -729,36 +1461,72 @@ Genera el informe con estas secciones EN ESTE ORDEN:
 
 10. **PIE DE PÁGINA**
     - Disclaimer legal
-    - Fecha: {now_utc}
+    - Fecha: {{now_utc}}
     - Sistema: {SYSTEM_NAME} v{ALGORITHM_VERSION}
 
 ══════════════════════════════════════════════════════════════
-ESTILOS CSS
+ESTILOS
 ══════════════════════════════════════════════════════════════
-- Fuente: Arial, Helvetica, sans-serif
-- Encabezados: #1a5276 (azul oscuro)
-- Riesgo BAJO: #27ae60 (verde)
-- Riesgo MODERADO: #f39c12 (amarillo/naranja)
-- Riesgo ALTO: #e67e22 (naranja)
-- Riesgo CRÍTICO: #c0392b (rojo)
-- Tablas: bordes #ddd, zebra striping, padding 8px
-- Badges de riesgo: bordes redondeados, padding 5px 15px
-- Optimizado para impresión A4
-- Fuente pequeña (11px) para tablas de datos
+NO incluyas bloques <style> ni atributos style: los estilos los aplica
+el servidor. Usa HTML puramente semántico con estas clases:
+- Badge de riesgo: <span class="badge riesgo-bajo|riesgo-moderado|riesgo-alto|riesgo-critico">
+- Valores alterados en tablas: <td class="alterado"> (amarillo) o <td class="critico"> (rojo)
+- Valores normales: <td class="normal">
 
 Devuelve SOLO HTML válido y completo. Sin explicaciones ni markdown."""
 
+# Estilos del informe: parseados una sola vez al arrancar (fuentes + CSS
+# dominan el coste de render en documentos pequeños); el LLM ya no emite <style>
+_FONT_CONF = FontConfiguration()
+_BASE_CSS = CSS(string="""
+    @page { size: A4; margin: 1.5cm; }
+    body { font-family: Arial, Helvetica, sans-serif; font-size: 12px; color: #333; }
+    h1, h2, h3 { color: #1a5276; }
+    table { border-collapse: collapse; width: 100%; font-size: 11px; }
+    th, td { border: 1px solid #ddd; padding: 8px; }
+    tr:nth-child(even) { background: #f6f8fa; }
+    .badge { border-radius: 10px; padding: 5px 15px; color: #fff; font-weight: bold; }
+    .riesgo-bajo { background: #27ae60; }
+    .riesgo-moderado { background: #f39c12; }
+    .riesgo-alto { background: #e67e22; }
+    .riesgo-critico { background: #c0392b; }
+    td.normal { color: #27ae60; }
+    td.alterado { background: #fcf3cf; }
+    td.critico { background: #fadbd8; color: #c0392b; font-weight: bold; }
+""", font_config=_FONT_CONF)
+
 # ============================================================
 # EMAIL FUNCTIONS
 # ============================================================
 
+# La configuración solo cambia vía /api/email/config; cachear el diagnóstico
+_email_diag_cache = None
+_email_diag_dirty = True
+
 def check_email_config():
+    global _email_diag_cache, _email_diag_dirty
+    if not _email_diag_dirty and _email_diag_cache is not None:
+        return _email_diag_cache
     issues = []
     if not MAILJET_API_KEY: issues.append("MAILJET_API_KEY no configurado")
     if not MAILJET_SECRET_KEY: issues.append("MAILJET_SECRET_KEY no configurado")
     if not MAILJET_SENDER_EMAIL: issues.append("MAILJET_SENDER_EMAIL no configurado")
     if not email_config.get("email_to"): issues.append("Email destinatario no configurado")
-    return {"configured": len(issues)==0, "issues": issues, "provider": "Mailjet API"}
+    _email_diag_cache = {"configured": len(issues)==0, "issues": issues, "provider": "Mailjet API"}
+    _email_diag_dirty = False
+    return _email_diag_cache
+
+# Fragmentos estáticos del email pre-renderizados por color: en el camino
+# caliente de alertas solo se interpolan título, valores, paciente y fecha
+_EMAIL_FRAGS = {
+    c: (f'<!DOCTYPE html><html><body style="font-family:Arial;max-width:600px;margin:auto;padding:20px;">'
+        f'<div style="background:{c};color:white;padding:20px;border-radius:10px 10px 0 0;text-align:center;"><h1 style="margin:0;">',
+        f'</h1></div><div style="background:#f8f9fa;padding:20px;border-radius:0 0 10px 10px;">'
+        f'<div style="font-size:42px;font-weight:bold;color:{c};text-align:center;margin:20px;">')
+    for c in ("#17a2b8", "#dc3545")
+}
+_EMAIL_FOOT = f'<p style="font-size:11px;color:#888;text-align:center;">{SYSTEM_NAME} v{ALGORITHM_VERSION} | '
+_EMAIL_TAIL = '</p></div></body></html>'
 
 def generate_email_html(alert_type, spo2, hr, patient_info):
     now = datetime.now(timezone.utc).strftime("%d/%m/%Y %H:%M:%S UTC")
@@ -769,30 +1537,36 @@ def generate_email_html(alert_type, spo2, hr, patient_info):
         title = f"⚠️ ALERTA: SpO2 Bajo ({spo2}%)"
     else:
         title = f"⚠️ ALERTA: {'Bradicardia' if hr < CRITICAL_HR_LOW else 'Taquicardia'} ({hr} bpm)"
-    
-    return f"""<!DOCTYPE html><html><body style="font-family:Arial;max-width:600px;margin:auto;padding:20px;">
-    <div style="background:{color};color:white;padding:20px;border-radius:10px 10px 0 0;text-align:center;"><h1 style="margin:0;">{title}</h1></div>
-    <div style="background:#f8f9fa;padding:20px;border-radius:0 0 10px 10px;">
-    <div style="font-size:42px;font-weight:bold;color:{color};text-align:center;margin:20px;">SpO2: {spo2}% | HR: {hr} bpm</div>
-    <p><strong>Paciente:</strong> {patient_info.get('name','N/A')} | <strong>Hab:</strong> {patient_info.get('room','N/A')}</p>
-    <p style="font-size:11px;color:#888;text-align:center;">{SYSTEM_NAME} v{ALGORITHM_VERSION} | {now}</p>
-    </div></body></html>"""
+
+    head, mid = _EMAIL_FRAGS[color]
+    return "".join((head, title, mid,
+                    f"SpO2: {spo2}% | HR: {hr} bpm</div>",
+                    f"<p><strong>Paciente:</strong> {patient_info.get('name','N/A')} | <strong>Hab:</strong> {patient_info.get('room','N/A')}</p>",
+                    _EMAIL_FOOT, now, _EMAIL_TAIL))
+
+# Sesión persistente hacia Mailjet: reutiliza la conexión TLS (keep-alive),
+# así las alertas posteriores no pagan handshake + negociación por envío
+_mailjet_session = requests.Session()
+_mailjet_session.auth = (MAILJET_API_KEY, MAILJET_SECRET_KEY)
+# Pool dimensionado al GreenPool de emails (4 envíos en paralelo) con un
+# reintento ante conexiones keep-alive que el servidor cerró por inactividad
+_mailjet_session.mount("https://", requests.adapters.HTTPAdapter(
+    pool_connections=1, pool_maxsize=4, max_retries=1))
 
 def send_email_mailjet(recipient, subject, html):
     """Envía email usando Mailjet API"""
-    if not MAILJET_API_KEY or not MAILJET_SECRET_KEY: 
+    if not MAILJET_API_KEY or not MAILJET_SECRET_KEY:
         return {"success": False, "error": "API keys no configuradas"}
     if not MAILJET_SENDER_EMAIL:
         return {"success": False, "error": "Email remitente no configurado"}
-    if not recipient: 
+    if not recipient:
         return {"success": False, "error": "Sin destinatario"}
-    
-    print(f"📧 Enviando a {recipient}...")
-    
+
+    log.info(f"📧 Enviando a {recipient}...")
+
     try:
-        r = requests.post(
+        r = _mailjet_session.post(
             "https://api.mailjet.com/v3.1/send",
-            auth=(MAILJET_API_KEY, MAILJET_SECRET_KEY),
             json={
                 "Messages": [{
                     "From": {
@@ -806,40 +1580,48 @@ def send_email_mailjet(recipient, subject, html):
                     "HTMLPart": html
                 }]
             },
-            timeout=30
+            timeout=10
         )
         
         if r.status_code == 200:
             result = r.json()
             if result.get("Messages", [{}])[0].get("Status") == "success":
-                print(f"✅ Email enviado correctamente!")
+                log.info(f"✅ Email enviado correctamente!")
                 return {"success": True}
         
-        print(f"❌ Error: {r.status_code} - {r.text}")
+        log.error(f"❌ Error: {r.status_code} - {r.text}")
         return {"success": False, "error": f"HTTP {r.status_code}"}
         
     except Exception as e:
-        print(f"❌ Error: {e}")
+        log.error(f"❌ Error: {e}")
         return {"success": False, "error": str(e)}
 
-def send_alert_email(alert_type, spo2, hr):
-    recipient = email_config.get("email_to")
-    if not recipient: return False
-    patient_info = {"name": email_config.get("patient_name","N/A"), "room": email_config.get("patient_room","N/A")}
-    if alert_type == 'spo2':
-        subject = f"⚠️ ALERTA HumanS - SpO2 {spo2}% - {patient_info['name']}"
-    else:
-        cond = "Bradicardia" if hr < CRITICAL_HR_LOW else "Taquicardia"
-        subject = f"⚠️ ALERTA HumanS - {cond} {hr}bpm - {patient_info['name']}"
-    
-    result = send_email_mailjet(recipient, subject, generate_email_html(alert_type, spo2, hr, patient_info))
-    save_alert(alert_type, spo2, hr, subject, result["success"], recipient, patient_info["name"])
+# Pool acotado para envíos: en una tormenta de alertas con Mailjet lento los
+# trabajos esperan su turno en vez de apilar greenlets (y conexiones) sin límite
+email_pool = eventlet.GreenPool(4)
+
+def send_alert_email(alert_type, spo2, hr, recipient, subject, html):
+    """Tarea de fondo: solo envía y persiste; todo llega pre-renderizado."""
+    result = send_email_mailjet(recipient, subject, html)
+    save_alert(alert_type, spo2, hr, subject, result["success"], recipient, _patient_info.name)
+    # Volcar ya: la alerta debe ser durable antes de anunciar el envío,
+    # no cuando toque el siguiente tick del flusher
+    flush_alerts()
     if result["success"]:
         socketio.emit('alert_sent', {'type': alert_type, 'message': f'Email enviado a {recipient}'})
     return result["success"]
 
 def send_alert_async(alert_type, spo2, hr):
-    eventlet.spawn(lambda: send_alert_email(alert_type, spo2, hr))
+    recipient = email_config.get("email_to")
+    if not recipient: return
+    info = _patient_info
+    if alert_type == 'spo2':
+        subject = f"⚠️ ALERTA HumanS - SpO2 {spo2}% - {info.name}"
+    else:
+        cond = "Bradicardia" if hr < CRITICAL_HR_LOW else "Taquicardia"
+        subject = f"⚠️ ALERTA HumanS - {cond} {hr}bpm - {info.name}"
+    html = generate_email_html(alert_type, spo2, hr, {"name": info.name, "room": info.room})
+    email_pool.spawn_n(send_alert_email, alert_type, spo2, hr, recipient, subject, html)
 
 def generate_device_connected_html(patient_info):
     """Genera HTML para notificación de dispositivo conectado"""
@@ -865,22 +1647,97 @@ def send_device_connected_notification():
     recipient = email_config.get("email_to")
     if not recipient:
         return False
-    
-    patient_info = {
-        "name": email_config.get("patient_name", "N/A"),
-        "room": email_config.get("patient_room", "N/A"),
-        "residence": email_config.get("patient_residence", "N/A")
-    }
-    
+
+    info = _patient_info
+    patient_info = {"name": info.name, "room": info.room, "residence": info.residence}
+
     subject = f"🟢 HumanS - Dispositivo Conectado - {patient_info['name']}"
     result = send_email_mailjet(recipient, subject, generate_device_connected_html(patient_info))
     
     if result["success"]:
-        print(f"✅ Notificación de conexión enviada a {recipient}")
+        log.info(f"✅ Notificación de conexión enviada a {recipient}")
     return result["success"]
 
 def send_device_connected_async():
-    eventlet.spawn(send_device_connected_notification)
+    email_pool.spawn_n(send_device_connected_notification)
+
+# ============================================================
+# WEBSOCKET BROADCASTER
+# ============================================================
+
+data_queue = eventlet.queue.Queue()
+
+# Cola por cliente + greenlet de relevo: un dashboard lento solo se degrada a
+# sí mismo (descarte del frame más antiguo), nunca frena al broadcaster
+CLIENT_QUEUE_MAX = 32
+BROADCAST_MIN_INTERVAL = 0.1  # Segundos: tope de ~10 frames/s hacia los dashboards
+_client_queues = {}  # sid -> Queue
+
+def _relay(sid, q):
+    while True:
+        item = q.get()
+        if item is None: return
+        event, payload = item
+        socketio.emit(event, payload, to=sid)
+
+def _offer(q, item):
+    try:
+        q.put_nowait(item)
+    except eventlet.queue.Full:
+        try: q.get_nowait()  # Descartar el más antiguo; el nuevo trae el estado completo
+        except eventlet.queue.Empty: pass
+        q.put_nowait(item)
+
+def _process_queue():
+    """Drena la cola de emisiones con semántica último-gana.
+
+    Los clientes mantienen su ventana localmente a partir de eventos
+    'sample' (solo la muestra nueva + telemetría, unas decenas de bytes);
+    el histórico completo viaja únicamente en los 'snapshot' de conexión
+    y resincronización. La espera tras el primer frame limita la tasa de
+    emisión a ~10 Hz por mucho que suba la tasa de ingesta.
+    """
+    while True:
+        try:
+            sample = data_queue.get(timeout=0.5)
+        except eventlet.queue.Empty:
+            continue
+        eventlet.sleep(BROADCAST_MIN_INTERVAL)  # Dejar acumular la ráfaga y coalescer
+        while True:
+            try:
+                sample = data_queue.get_nowait()
+            except eventlet.queue.Empty:
+                break
+        for q in list(_client_queues.values()):
+            _offer(q, ('sample', sample))
+
+# Última telemetría emitida a los dashboards: permite omitirla del 'sample'
+# mientras no cambie de forma apreciable (el snapshot la lleva siempre)
+_last_telemetry = {"distance": None, "rssi": None}
+TELEMETRY_DIST_DELTA = 0.1   # Metros
+TELEMETRY_RSSI_DELTA = 2     # dBm
+
+def _telemetry_changed(distance, rssi):
+    prev_d, prev_r = _last_telemetry["distance"], _last_telemetry["rssi"]
+    if (distance is None) != (prev_d is None) or (rssi is None) != (prev_r is None):
+        return True
+    if distance is not None and abs(distance - prev_d) > TELEMETRY_DIST_DELTA:
+        return True
+    if rssi is not None and abs(rssi - prev_r) > TELEMETRY_RSSI_DELTA:
+        return True
+    return False
+
+# Resincronización periódica: corrige cualquier deriva de la ventana local
+# de los clientes (frames descartados por backpressure, reconexiones a medias)
+SNAPSHOT_RESYNC_SECS = 30
+
+def _snapshot_resync():
+    while True:
+        eventlet.sleep(SNAPSHOT_RESYNC_SECS)
+        if not _client_queues or not spo2_hist: continue
+        payload = _snapshot_payload()
+        for q in list(_client_queues.values()):
+            _offer(q, ('snapshot', payload))
 
 # ============================================================
 # AUTENTICACIÓN
@@ -905,123 +1762,241 @@ def dashboard():
     user = get_current_user()
     return render_template("index11.html")
 
+# Respuesta JSON directa para la ruta de ingesta: orjson.dumps devuelve bytes,
+# pero el proveedor de Flask los decodifica a str y Flask los vuelve a codificar
+# a utf-8; construir la Response con los bytes se ahorra ese viaje por paquete
+def _json_response(payload, status=200):
+    body = orjson.dumps(payload) if ORJSON_AVAILABLE else json.dumps(payload)
+    return app.response_class(body, status=status, mimetype="application/json")
+
 @app.route("/api/data", methods=["POST"])
 def receive_data():
     global packet_count, current_distance, current_rssi, last_packet_time
     global last_spo2_critical, last_hr_critical, last_spo2_alert_time, last_hr_alert_time
-    global last_device_connect_notification
+    global last_device_connect_notification, _hist_snapshot_dirty, _stats_generation
     try:
         p = request.get_json(force=True)
         spo2, hr = p.get("spo2"), p.get("hr")
-        if spo2 is None or hr is None: return jsonify({"error": "Missing data"}), 400
-        if not (35 <= spo2 <= 100) or not (25 <= hr <= 250): return jsonify({"error": "Out of range"}), 400
+        if spo2 is None or hr is None: return _json_response({"error": "Missing data"}, 400)
+        if not (35 <= spo2 <= 100) or not (25 <= hr <= 250): return _json_response({"error": "Out of range"}, 400)
         
         now_ts = time.time()
-        now_dt = datetime.now(timezone.utc)
 
         device_was_offline = (
             last_packet_time is None or
-            (now_dt - last_packet_time).total_seconds() > DEVICE_OFFLINE_TIMEOUT
+            now_ts - last_packet_time > DEVICE_OFFLINE_TIMEOUT
         )
 
         if device_was_offline and (now_ts - last_device_connect_notification > DEVICE_CONNECT_COOLDOWN):
-            print(f"🟢 Dispositivo conectado!")
+            log.info(f"🟢 Dispositivo conectado!")
             send_device_connected_async()
             last_device_connect_notification = now_ts
         
         packet_count += 1
         current_distance = p.get("distance", 0)
         current_rssi = p.get("rssi")
-        last_packet_time = now_dt 
-        spo2_hist.append(spo2)
-        hr_hist.append(hr)
-        
+        last_packet_time = now_ts
         spo2_crit = spo2 < CRITICAL_SPO2
         hr_crit = hr < CRITICAL_HR_LOW or hr > CRITICAL_HR_HIGH
-        eventlet.spawn(save_vital, spo2, hr, spo2_crit, hr_crit, current_distance, current_rssi, email_config.get("patient_name"))
+
+        _spo2_run.add(spo2, spo2_crit)
+        _hr_run.add(hr, hr_crit)
+        if spo2_crit or hr_crit: _stats_generation += 1
+
+        spo2_hist.append(spo2)
+        hr_hist.append(hr)
+        ts_hist.append(_fmt_hms(now_ts))
+        _hist_snapshot_dirty = True
+        # Los pulsioxímetros BLE repiten el último valor: no persistir lecturas
+        # idénticas no críticas dentro de la ventana de deduplicación
+        if db_pool and not (spo2 == _last_stored["spo2"] and hr == _last_stored["hr"]
+                            and not spo2_crit and not hr_crit
+                            and now_ts - _last_stored["t"] < STORE_DEDUP_WINDOW):
+            # Los sensores pueden mandar floats (spo2=97.5): las columnas son
+            # enteras y el COPY binario exige int, así que se redondea aquí
+            _enqueue_vital((int(round(spo2)), int(round(hr)), spo2_crit, hr_crit, current_distance,
+                            int(round(current_rssi)) if current_rssi is not None else None,
+                            email_config.get("patient_name")))
+            _last_stored["spo2"], _last_stored["hr"], _last_stored["t"] = spo2, hr, now_ts
         
         now = time.time()
         if spo2_crit and not last_spo2_critical:
-            print(f"🚨 SpO2 CRÍTICO: {spo2}%")
+            log.info(f"🚨 SpO2 CRÍTICO: {spo2}%")
             if now - last_spo2_alert_time > EMAIL_COOLDOWN:
                 send_alert_async('spo2', spo2, hr)
                 last_spo2_alert_time = now
         if hr_crit and not last_hr_critical:
-            print(f"🚨 HR CRÍTICO: {hr} bpm")
+            log.info(f"🚨 HR CRÍTICO: {hr} bpm")
             if now - last_hr_alert_time > EMAIL_COOLDOWN:
                 send_alert_async('hr', spo2, hr)
                 last_hr_alert_time = now
         
         last_spo2_critical, last_hr_critical = spo2_crit, hr_crit
         
-        socketio.emit('update', {"spo2": spo2, "hr": hr, "spo2_history": list(spo2_hist), 
-                                "hr_history": list(hr_hist), "spo2_critical": spo2_crit, "hr_critical": hr_crit})
-        socketio.emit('raw_update', {"count": packet_count, "distance": current_distance, "rssi": current_rssi})
-        return jsonify({"status": "ok", "packet": packet_count})
+        # Sin dashboards conectados no hay nada que emitir; con ellos, solo la
+        # muestra nueva: el histórico viaja en los snapshots, no por paquete.
+        # La telemetría (distancia/RSSI) cambia despacio: solo viaja cada 5
+        # paquetes o cuando varía de forma apreciable
+        if _client_queues:
+            sample = {"spo2": spo2, "hr": hr, "spo2_critical": spo2_crit, "hr_critical": hr_crit,
+                      "count": packet_count}
+            if (packet_count % 5 == 0
+                    or _telemetry_changed(current_distance, current_rssi)):
+                sample["distance"], sample["rssi"] = current_distance, current_rssi
+                _last_telemetry["distance"], _last_telemetry["rssi"] = current_distance, current_rssi
+            data_queue.put(sample)
+        return _json_response({"status": "ok", "packet": packet_count})
     except Exception as e:
-        print(f"[ERROR] {e}")
-        return jsonify({"error": str(e)}), 500
+        log.error(f"[ERROR] {e}")
+        return _json_response({"error": str(e)}, 500)
+
+# El LLM a veces envuelve el HTML en vallas markdown (```html ... ```)
+_FENCE_RE = re.compile(r'^\s*```(?:html)?\s*\n?(.*?)\n?```\s*$', re.DOTALL)
+
+# Caché de respuestas del LLM: mismo paciente + mismo resumen => mismo informe
+LLM_CACHE_TTL = 900
+LLM_CACHE_MAX = 128
+_llm_cache = {}  # key -> (expiry, html)
+
+def _llm_cache_key(patient, summary):
+    # El modelo y el system prompt entran en la clave: cambiar cualquiera de
+    # los dos invalida la caché en vez de servir informes del modelo anterior
+    raw = json.dumps([LLM_MODEL, SYSTEM_PROMPT_MEDICAL, patient, summary],
+                     sort_keys=True, default=str).encode()
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+def _llm_cache_store(key, html):
+    if len(_llm_cache) >= LLM_CACHE_MAX:
+        _llm_cache.pop(min(_llm_cache, key=lambda k: _llm_cache[k][0]))
+    _llm_cache[key] = (time.time() + LLM_CACHE_TTL, html)
+
+# Trabajos de informe en segundo plano: el POST devuelve un job_id y el
+# cliente sondea (o espera el evento 'report_ready') para descargar el PDF
+_report_jobs = {}  # job_id -> {"status", "created", "pdf", "filename", "error"}
+REPORT_JOB_TTL = 600
+
+def _prune_report_jobs():
+    cutoff = time.time() - REPORT_JOB_TTL
+    for jid in [j for j, v in _report_jobs.items() if v["created"] < cutoff]:
+        _report_jobs.pop(jid, None)
 
 @app.route("/api/report/pdf", methods=["POST"])
 def api_report_pdf():
-    """Genera informe médico PDF con análisis clínico completo"""
-    print("=== GENERANDO INFORME MÉDICO ===")
-    
+    """Encola la generación del informe médico PDF y devuelve un job_id"""
+    log.info("=== GENERANDO INFORME MÉDICO ===")
+    patient = request.get_json(silent=True) or {}
+    log.info(f"[LOG] Paciente: {patient}")
+    _prune_report_jobs()
+    job_id = uuid.uuid4().hex
+    _report_jobs[job_id] = {"status": "pending", "created": time.time()}
+    # ?nocache=1 fuerza regenerar aunque haya un informe idéntico cacheado
+    eventlet.spawn(_run_report_job, job_id, patient,
+                   request.args.get("nocache") == "1")
+    return jsonify({"status": "pending", "job_id": job_id}), 202
+
+@app.route("/api/report/pdf/<job_id>", methods=["GET"])
+def api_report_pdf_result(job_id):
+    job = _report_jobs.get(job_id)
+    if not job: return jsonify({"error": "Informe no encontrado"}), 404
+    if job["status"] == "pending": return jsonify({"status": "pending"}), 202
+    if job["status"] == "error": return jsonify({"error": job["error"]}), 500
+    return send_file(BytesIO(job["pdf"]), mimetype="application/pdf",
+                     as_attachment=True, download_name=job["filename"])
+
+def _render_pdf(html):
+    """Render de WeasyPrint; se ejecuta fuera del hub de eventlet."""
+    pdf = BytesIO()
+    HTML(string=html).write_pdf(pdf, stylesheets=[_BASE_CSS], font_config=_FONT_CONF)
+    return pdf.getvalue()
+
+# Pool de procesos para el render: WeasyPrint apenas suelta el GIL, así que
+# incluso en un hilo del tpool compite con el resto del proceso; en procesos
+# aparte los renders van en paralelo y no tocan este intérprete. El módulo
+# concurrent.futures se importa SIN parchear para que sus hilos internos sean
+# hilos reales y no greenlets (se usa desde hilos del tpool).
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", "2"))
+try:
+    _futures = eventlet.patcher.original("concurrent.futures")
+    _PDF_POOL = _futures.ProcessPoolExecutor(max_workers=PDF_WORKERS)
+except Exception as _e:
+    log.warning(f"⚠️ Pool de procesos PDF no disponible: {_e}")
+    _PDF_POOL = None
+
+def _render_pdf_blocking(html):
+    """Corre en un hilo del tpool: delega al pool de procesos si existe y
+    renderiza en el propio hilo como último recurso"""
+    if _PDF_POOL is not None:
+        try:
+            return _PDF_POOL.submit(_render_pdf, html).result(timeout=120)
+        except Exception as e:
+            log.warning(f"⚠️ Render en pool de procesos falló ({e}); render en hilo")
+    return _render_pdf(html)
+
+def _run_report_job(job_id, patient, nocache=False):
+    """Tarea de fondo: análisis + LLM + render del PDF"""
+    job = _report_jobs[job_id]
     try:
-        patient = request.get_json(silent=True) or {}
-        print(f"[LOG] Paciente: {patient}")
-        
         summary = process_data_for_analysis(hours=24)
-        print(f"[LOG] Resumen: {summary}")
-        
+        log.info(f"[LOG] Resumen: {summary}")
+
         if not summary:
-            return jsonify({"error": "No hay datos suficientes para generar el informe"}), 400
-
-        prompt = generate_llm_prompt(summary, patient)
-        print(f"[LOG] Prompt generado ({len(prompt)} chars)")
-
-        print("[LOG] Llamando a OpenAI...")
-        response = client.chat.completions.create(
-            model=LLM_MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT_MEDICAL},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2,
-            max_tokens=5500
-        )
-        
-        html_content = response.choices[0].message.content.strip()
-        print(f"[LOG] HTML recibido ({len(html_content)} chars)")
-
-        if html_content.startswith("```html"):
-            html_content = html_content[7:]
-        elif html_content.startswith("```"):
-            html_content = html_content[3:]
-        if html_content.endswith("```"):
-            html_content = html_content[:-3]
-        html_content = html_content.strip()
-
-        if "<html" not in html_content.lower() and "<!doctype" not in html_content.lower():
-            raise ValueError("La respuesta no es HTML válido")
-
-        print("[LOG] Generando PDF...")
-        pdf = BytesIO()
-        HTML(string=html_content).write_pdf(pdf)
-        pdf.seek(0)
-        print("[LOG] PDF generado ✓")
+            raise ValueError("No hay datos suficientes para generar el informe")
+
+        cache_key = _llm_cache_key(patient, summary)
+        cached = None if nocache else _llm_cache.get(cache_key)
+        if cached and cached[0] > time.time():
+            html_content = cached[1]
+            log.info("[LOG] HTML recuperado de caché LLM")
+        else:
+            prompt = generate_llm_prompt(summary, patient)
+            log.info(f"[LOG] Prompt generado ({len(prompt)} chars)")
+
+            log.info("[LOG] Llamando a OpenAI...")
+            # stream=True: el hub de eventlet cede entre chunks durante la
+            # generación (decenas de segundos) en vez de bloquear en una
+            # única lectura larga, y un fallo a mitad aborta antes
+            stream = client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT_MEDICAL},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.2,
+                max_tokens=5500,
+                stream=True
+            )
+            parts = []
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+            html_content = "".join(parts).strip()
+            log.info(f"[LOG] HTML recibido ({len(html_content)} chars)")
+
+            m = _FENCE_RE.match(html_content)
+            if m:
+                html_content = m.group(1).strip()
+
+            if "<html" not in html_content.lower() and "<!doctype" not in html_content.lower():
+                raise ValueError("La respuesta no es HTML válido")
+
+            _llm_cache_store(cache_key, html_content)
+
+        log.info("[LOG] Generando PDF...")
+        # El hilo del tpool mantiene el hub respondiendo; dentro de él, el
+        # pool de procesos aísla el render CPU-bound del intérprete entero
+        pdf_bytes = tpool.execute(_render_pdf_blocking, html_content)
+        log.info("[LOG] PDF generado ✓")
 
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         patient_name = patient.get('name', 'paciente').replace(' ', '_')
         filename = f"informe_{patient_name}_{timestamp}.pdf"
 
-        return send_file(pdf, mimetype="application/pdf", as_attachment=True, download_name=filename)
+        job.update({"status": "done", "pdf": pdf_bytes, "filename": filename})
+        socketio.emit('report_ready', {'job_id': job_id})
 
     except Exception as e:
-        print(f"[ERROR] {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": f"Error al generar el informe: {str(e)}"}), 500
+        log.exception(f"[ERROR] {type(e).__name__}: {e}")
+        job.update({"status": "error", "error": f"Error al generar el informe: {str(e)}"})
 
 @app.route("/api/email/config", methods=["GET"])
 def get_email_cfg():
@@ -1032,14 +2007,13 @@ def get_email_cfg():
 
 @app.route("/api/email/config", methods=["POST"])
 def set_email_cfg():
-    global email_config
     d = request.get_json()
     email = d.get("email_to","").strip()
     if not email or "@" not in email: return jsonify({"error": "Email inválido"}), 400
-    email_config = {"email_to": email, "patient_name": d.get("patient_name",""),
-                   "patient_room": d.get("patient_room",""), "patient_residence": d.get("patient_residence","")}
+    _set_email_config({"email_to": email, "patient_name": d.get("patient_name",""),
+                       "patient_room": d.get("patient_room",""), "patient_residence": d.get("patient_residence","")})
     save_email_config_db(email, email_config["patient_name"], email_config["patient_room"], email_config["patient_residence"])
-    print(f"✅ Email configurado: {email}")
+    log.info(f"✅ Email configurado: {email}")
     return jsonify({"status": "ok", "email_to": email})
 
 @app.route("/api/email/test", methods=["POST"])
@@ -1053,36 +2027,165 @@ def test_email():
     if result["success"]: return jsonify({"status": "ok", "message": f"✅ Email enviado a {recipient}"})
     return jsonify({"error": result.get("error")}), 500
 
+# Parte estática del diagnóstico, construida una vez al importar
+_DIAG_STATIC = {"version": ALGORITHM_VERSION,
+                "thresholds": {"spo2_critical": CRITICAL_SPO2, "hr_low": CRITICAL_HR_LOW, "hr_high": CRITICAL_HR_HIGH},
+                "cooldown_seconds": EMAIL_COOLDOWN}
+
 @app.route("/api/diagnostics", methods=["GET"])
 def diagnostics():
-    return jsonify({"packet_count": packet_count, "version": ALGORITHM_VERSION,
-                   "email": check_email_config(), "database": "ok" if db_pool else "no"})
+    resp = _DIAG_STATIC.copy()
+    resp.update({"packet_count": packet_count, "email": check_email_config(),
+                 "database": "ok" if db_pool else "no",
+                 "ingest_queue": len(pending_vitals), "ingest_dropped": _vitals_dropped})
+    return jsonify(resp)
 
 @app.route("/api/data/statistics", methods=["GET"])
-def stats(): 
+def stats():
     return jsonify(get_statistics() or {"error": "No data"})
 
+# Topes para los query params de histórico: acotan el tamaño de respuesta
+# y el número de claves distintas que puede acumular la micro-caché
+HISTORY_MAX_LIMIT = 10000
+HISTORY_MAX_HOURS = 8760  # Un año
+
+@app.route("/api/history", methods=["GET"])
+def get_history():
+    hours = min(max(request.args.get('hours', 24, type=int), 1), HISTORY_MAX_HOURS)
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), HISTORY_MAX_LIMIT)
+    data = get_vital_signs(limit=limit, hours=hours)
+    return jsonify({"status": "ok", "count": len(data), "data": data})
+
+@app.route("/api/alerts/history", methods=["GET"])
+def get_alerts():
+    hours = min(max(request.args.get('hours', 24, type=int), 1), HISTORY_MAX_HOURS)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), HISTORY_MAX_LIMIT)
+    alerts = get_alerts_history(limit=limit, hours=hours)
+    return jsonify({"status": "ok", "count": len(alerts), "alerts": alerts})
+
+CSV_HEADER = ("timestamp", "spo2", "hr", "spo2_critical", "hr_critical")
+
+CSV_EXPORT_MAX_ROWS = 500000  # Cortafuegos, no truncado silencioso a 10k
+
+def _csv_rows(hours, max_rows=CSV_EXPORT_MAX_ROWS):
+    """Genera el CSV con COPY TO STDOUT: PostgreSQL produce el CSV entero.
+
+    copy_expert escribe en un objeto fichero, así que un greenlet bombea los
+    trozos a una cola acotada y el generador HTTP los consume; DB y red
+    quedan solapadas y en memoria nunca hay más que unos pocos trozos.
+    """
+    conn = get_db_connection()
+    if not conn:
+        yield ",".join(CSV_HEADER) + "\r\n"
+        return
+
+    chunks = eventlet.queue.Queue(16)
+    cancelled = [False]  # El cliente cortó la descarga: abortar el COPY
+
+    class _QueueWriter:
+        def write(self, data):
+            if cancelled[0]:
+                raise IOError("export cancelado: cliente desconectado")
+            chunks.put(data)
+
+    # copy_expert no admite parámetros: forzar int antes de interpolar
+    sql = f"""COPY (SELECT to_char(timestamp, 'YYYY-MM-DD"T"HH24:MI:SS') AS timestamp,
+                           spo2, hr, spo2_critical, hr_critical
+                    FROM vital_signs
+                    WHERE timestamp > NOW() - make_interval(hours => {int(hours)})
+                    ORDER BY timestamp ASC LIMIT {int(max_rows)})
+              TO STDOUT WITH CSV HEADER"""
+
+    def _pump():
+        try:
+            with conn.cursor() as cur:
+                cur.copy_expert(sql, _QueueWriter(), size=8192)
+        except Exception as e:
+            if cancelled[0]:
+                log.info("📤 Export CSV cancelado por el cliente")
+            else:
+                log.error(f"[ERROR] export_csv: {e}")
+        finally:
+            release_db_connection(conn)
+            chunks.put(None)
+
+    eventlet.spawn(_pump)
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None: break
+            yield chunk
+    finally:
+        # Si el cliente desconecta a medias, GeneratorExit aterriza aquí: marcar
+        # la cancelación y vaciar la cola para desbloquear un put pendiente; el
+        # siguiente write del COPY lanza y el finally de _pump suelta la conexión
+        cancelled[0] = True
+        while True:
+            try: chunks.get_nowait()
+            except eventlet.queue.Empty: break
+
+@app.route("/api/export/csv", methods=["GET"])
+def export_csv():
+    """Exporta las constantes vitales como CSV en streaming"""
+    hours = min(max(request.args.get("hours", 24, type=int), 1), HISTORY_MAX_HOURS)
+    max_rows = min(max(request.args.get("max_rows", CSV_EXPORT_MAX_ROWS, type=int), 1), CSV_EXPORT_MAX_ROWS)
+    filename = f"vitals_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return Response(stream_with_context(_csv_rows(hours, max_rows)), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
 # ============================================================
 # WEBSOCKET
 # ============================================================
 
+def _tune_client_socket():
+    """Desactiva Nagle (y activa QUICKACK en Linux) en el socket del cliente WS.
+
+    Los frames de vitales son pequeños y sensibles a latencia; sin esto Nagle
+    puede retenerlos hasta ~40 ms esperando más datos.
+    """
+    try:
+        inp = request.environ.get('eventlet.input')
+        sock = inp.get_socket() if inp else None
+        if sock is None: return
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if hasattr(socket, 'TCP_QUICKACK'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+    except Exception:
+        pass
+
+def _snapshot_payload():
+    """Estado completo (vitales + telemetría): conexión y resincronización."""
+    payload = {"count": packet_count, "distance": current_distance, "rssi": current_rssi}
+    if spo2_hist:
+        spo2_snap, hr_snap, crit_snap = get_hist_snapshot()
+        last_spo2, last_hr = spo2_hist.last(), hr_hist.last()
+        payload.update({"spo2": last_spo2, "hr": last_hr, "spo2_history": spo2_snap,
+                        "hr_history": hr_snap, "crit_history": crit_snap,
+                        "spo2_critical": last_spo2 < CRITICAL_SPO2,
+                        "hr_critical": last_hr < CRITICAL_HR_LOW or last_hr > CRITICAL_HR_HIGH})
+    return payload
+
 @socketio.on('connect')
 def on_connect():
-    print(f'[WS] Conectado ({len(spo2_hist)} datos)')
-    if spo2_hist:
-        socketio.emit('update', {"spo2": spo2_hist[-1], "hr": hr_hist[-1], "spo2_history": list(spo2_hist),
-                                "hr_history": list(hr_hist), "spo2_critical": spo2_hist[-1] < CRITICAL_SPO2,
-                                "hr_critical": hr_hist[-1] < CRITICAL_HR_LOW or hr_hist[-1] > CRITICAL_HR_HIGH})
-    socketio.emit('raw_update', {"count": packet_count, "distance": current_distance, "rssi": current_rssi})
+    log.info(f'[WS] Conectado ({len(spo2_hist)} datos)')
+    _tune_client_socket()
+    # Un único mensaje inicial con vitales + telemetría, solo al cliente que conecta
+    socketio.emit('snapshot', _snapshot_payload(), to=request.sid)
+    q = eventlet.queue.Queue(CLIENT_QUEUE_MAX)
+    _client_queues[request.sid] = q
+    eventlet.spawn(_relay, request.sid, q)
 
 @socketio.on('disconnect')
-def on_disconnect(): print('[WS] Desconectado')
+def on_disconnect():
+    q = _client_queues.pop(request.sid, None)
+    if q: q.put(None)  # Despierta y termina el greenlet de relevo
+    log.info('[WS] Desconectado')
 
 # ============================================================
 # INICIALIZACIÓN (se ejecuta siempre, incluso con gunicorn)
 # ============================================================
 
-print(f"""
+log.info(f"""
 ╔══════════════════════════════════════════════════════════════╗
 ║  {SYSTEM_NAME}
 ║  Versión: {ALGORITHM_VERSION}
@@ -1098,7 +2201,19 @@ print(f"""
 if init_db_pool():
     init_database()
 else:
-    print("⚠️ Ejecutando SIN base de datos (solo memoria)")
+    log.warning("⚠️ Ejecutando SIN base de datos (solo memoria)")
+
+# Greenlets que agrupan las emisiones WebSocket y resincronizan ventanas
+eventlet.spawn(_process_queue)
+eventlet.spawn(_snapshot_resync)
+
+# Greenlet que vuelca la ingesta por lotes; drenar lo pendiente al apagar
+eventlet.spawn(_vitals_flusher)
+if db_pool:
+    eventlet.spawn(_partition_maintainer)
+    eventlet.spawn(_config_listener)
+atexit.register(_flush_pending_vitals)
+atexit.register(flush_alerts)
 
 # ============================================================
 # MAIN (solo para ejecución local directa)